@@ -1,222 +1,344 @@
 """Configuration management for Tuya2MQTT"""
 
+import copy
+import hashlib
 import yaml
 import logging
+from dataclasses import dataclass, fields
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, FrozenSet, Optional
 
 logger = logging.getLogger(__name__)
 
+# Prefer the libyaml-backed C implementations (install libyaml before PyYAML
+# to get them), falling back to the pure-Python safe loader/dumper.
+_Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+_Dumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
+
+# Parsed configs keyed by a digest of the file contents
+_PARSE_CACHE: Dict[bytes, Any] = {}
+_PARSE_CACHE_SIZE = 8
+
+# Example configuration with all platform types, written verbatim when the
+# config file is missing
+_EXAMPLE_CONFIG_YAML = """\
+adaptive_polling:
+  enabled: false
+  max_interval: 300
+  min_interval: 5
+database:
+  enabled: true
+  path: tuya2mqtt.db
+devices:
+  alarm_device_id:
+    entities:
+    - dps:
+        mode: 2
+        state: 1
+      friendly_name: Domácí alarm
+      icon: mdi:shield-home
+      name: alarm
+      platform: alarm_control_panel
+      states:
+        armed_away: away
+        armed_home: home
+        disarmed: disarmed
+        triggered: sos
+    ip: 192.168.1.102
+    local_key: your_key
+    name: Alarm
+    version: '3.3'
+  bf1234567890abcdef:
+    entities:
+    - brightness_range:
+      - 10
+      - 1000
+      color_temp_range:
+      - 0
+      - 1000
+      dps:
+        brightness: 2
+        color_temp: 3
+        switch: 1
+      friendly_name: Hlavní světlo
+      icon: mdi:lightbulb
+      name: main_light
+      platform: light
+    ip: 192.168.1.100
+    local_key: your_local_key
+    name: Chytré světlo
+    version: '3.3'
+  camera_device_id:
+    entities:
+    - dps:
+        motion_detect: 2
+        night_vision: 3
+        power: 1
+      friendly_name: Vstupní kamera
+      icon: mdi:cctv
+      name: camera
+      platform: camera
+      stream_url: rtsp://192.168.1.105:554/stream
+    ip: 192.168.1.105
+    local_key: your_key
+    name: Kamera
+    version: '3.3'
+  climate_device_id:
+    entities:
+    - dps:
+        current_temp: 2
+        fan_mode: 5
+        mode: 4
+        switch: 1
+        target_temp: 3
+      fan_modes:
+      - auto
+      - low
+      - medium
+      - high
+      friendly_name: Termostat
+      icon: mdi:thermostat
+      modes:
+      - 'off'
+      - heat
+      - cool
+      - auto
+      name: thermostat
+      platform: climate
+      temp_range:
+      - 16
+      - 30
+      temp_step: 0.5
+      temperature_unit: C
+    ip: 192.168.1.101
+    local_key: your_key
+    name: Termostat
+    version: '3.3'
+  humidifier_device_id:
+    entities:
+    - dps:
+        humidity: 3
+        mode: 2
+        switch: 1
+        target_humidity: 4
+      friendly_name: Zvlhčovač vzduchu
+      humidity_range:
+      - 30
+      - 80
+      icon: mdi:air-humidifier
+      modes:
+      - auto
+      - low
+      - medium
+      - high
+      name: humidifier
+      platform: humidifier
+    ip: 192.168.1.106
+    local_key: your_key
+    name: Zvlhčovač
+    version: '3.3'
+  lock_device_id:
+    entities:
+    - dps:
+        battery: 2
+        lock: 1
+      friendly_name: Zámek dveří
+      icon: mdi:door-closed-lock
+      name: door_lock
+      platform: lock
+    ip: 192.168.1.104
+    local_key: your_key
+    name: Chytrý zámek
+    version: '3.3'
+  vacuum_device_id:
+    entities:
+    - dps:
+        battery: 4
+        direction: 3
+        mode: 2
+        power: 1
+        status: 5
+      friendly_name: Vysavač
+      icon: mdi:robot-vacuum
+      modes:
+      - auto
+      - spot
+      - edge
+      - single_room
+      name: vacuum
+      platform: vacuum
+    ip: 192.168.1.103
+    local_key: your_key
+    name: Robotický vysavač
+    version: '3.3'
+discovery:
+  cache_file: discovered_cache.json
+  cache_ttl: 300
+  enabled: false
+  idle_timeout: 6
+  interface: null
+  network: 192.168.1.0/24
+  pin_cpu: false
+  save_discovered: true
+  timeout: 20
+homeassistant:
+  discovery_cache_file: ha_discovery_cache.json
+  enabled: true
+mqtt:
+  base_topic: tuya2mqtt
+  discovery_prefix: homeassistant
+  host: localhost
+  password: null
+  port: 1883
+  protocol: 3.1.1
+  username: null
+poll_interval: 30
+web:
+  enabled: true
+  port: 8099
+"""
+
+
+@dataclass(frozen=True)
+class MqttConfig:
+    """MQTT broker connection settings"""
+    host: str = 'localhost'
+    port: int = 1883
+    username: Optional[str] = None
+    password: Optional[str] = None
+    base_topic: str = 'tuya2mqtt'
+    discovery_prefix: str = 'homeassistant'
+    protocol: str = '3.1.1'
+
+
+@dataclass(frozen=True)
+class WebConfig:
+    """Web interface settings"""
+    enabled: bool = True
+    port: int = 8099
+
+
+@dataclass(frozen=True)
+class HomeAssistantConfig:
+    """Home Assistant discovery settings"""
+    enabled: bool = True
+    # Digests of the retained discovery payloads already on the broker
+    discovery_cache_file: str = 'ha_discovery_cache.json'
+
+
+@dataclass(frozen=True)
+class DiscoveryConfig:
+    """Automatic device discovery settings"""
+    enabled: bool = False
+    network: Optional[str] = None
+    save_discovered: bool = True
+    # Maximum scan time and how long to keep listening once no new device shows up
+    timeout: float = 20.0
+    idle_timeout: float = 6.0
+    # Scan results are reused for this many seconds, also across restarts
+    cache_ttl: float = 300
+    cache_file: str = 'discovered_cache.json'
+    interface: Optional[str] = None
+    pin_cpu: bool = False
+
+
+@dataclass(frozen=True)
+class AdaptivePollingConfig:
+    """Per-device poll intervals fitted to how often device state changes"""
+    enabled: bool = False
+    min_interval: float = 5
+    max_interval: float = 300
+    
+    def __post_init__(self):
+        # The fitted schedule divides by min_interval-wide windows
+        if not self.min_interval > 0:
+            raise ValueError(f"adaptive_polling.min_interval must be greater than 0, got {self.min_interval}")
+        if self.max_interval < self.min_interval:
+            raise ValueError(f"adaptive_polling.max_interval must not be below min_interval, got {self.max_interval}")
+
+
+def _section(cls, data: Optional[Dict[str, Any]]):
+    """Build a settings dataclass from a config section, ignoring unknown keys"""
+    data = data or {}
+    return cls(**{f.name: data[f.name] for f in fields(cls) if f.name in data})
+
+
+def _parse_yaml(data: bytes) -> Any:
+    """Parse YAML bytes, reusing the cached result for identical content"""
+    key = hashlib.blake2b(data, digest_size=16).digest()
+    parsed = _PARSE_CACHE.get(key)
+    if parsed is None:
+        parsed = yaml.load(data, Loader=_Loader)
+        if len(_PARSE_CACHE) >= _PARSE_CACHE_SIZE:
+            _PARSE_CACHE.pop(next(iter(_PARSE_CACHE)))
+        _PARSE_CACHE[key] = parsed
+    # Callers mutate the config, so never hand out the cached object
+    return copy.deepcopy(parsed)
+
 
 class ConfigManager:
     """Manages configuration loading and validation"""
     
     def __init__(self, config_file: str):
         self.config_file = config_file
+        self._device_ids = frozenset()
+        self._device_ids_key = None
         self.config = self.load_config()
+        self._load_sections()
+    
+    def _load_sections(self):
+        """Expose the config sections as attributes, read once at load time"""
+        config = self.config
+        self.mqtt = _section(MqttConfig, config.get('mqtt'))
+        self.web = _section(WebConfig, config.get('web'))
+        self.homeassistant = _section(HomeAssistantConfig, config.get('homeassistant'))
+        self.discovery = _section(DiscoveryConfig, config.get('discovery'))
+        self.adaptive_polling = _section(AdaptivePollingConfig, config.get('adaptive_polling'))
+        self.poll_interval = config.get('poll_interval', 30)
     
     def load_config(self) -> Dict[str, Any]:
         """Load configuration from YAML file"""
         try:
-            with open(self.config_file, 'r', encoding='utf-8') as f:
-                config = yaml.safe_load(f)
-                logger.info(f"Configuration loaded from {self.config_file}")
-                return config
+            # Read the whole file at once; the C loader parses bytes directly
+            data = Path(self.config_file).read_bytes()
+            config = _parse_yaml(data)
+            logger.info(f"Configuration loaded from {self.config_file}")
+            return config
         except FileNotFoundError:
             logger.error(f"Config file {self.config_file} not found!")
             self.create_example_config()
             raise SystemExit(1)
     
+    def get_device_ids(self) -> FrozenSet[str]:
+        """Get the IDs of all configured devices"""
+        devices = self.config.get('devices') or {}
+        # Rebuilt when the devices section is replaced, resized or saved
+        key = (id(devices), len(devices))
+        if key != self._device_ids_key:
+            self._device_ids = frozenset(devices)
+            self._device_ids_key = key
+        return self._device_ids
+    
     def save_config(self):
         """Save current configuration to file"""
+        self._device_ids_key = None
         try:
+            data = yaml.dump(self.config, Dumper=_Dumper, default_flow_style=False, allow_unicode=True)
             with open(self.config_file, 'w', encoding='utf-8') as f:
-                yaml.dump(self.config, f, default_flow_style=False, allow_unicode=True)
+                f.write(data)
             logger.info(f"Configuration saved to {self.config_file}")
         except Exception as e:
             logger.error(f"Failed to save config: {e}")
     
     def create_example_config(self):
         """Create example configuration with all platform types"""
-        example_config = {
-            'mqtt': {
-                'host': 'localhost',
-                'port': 1883,
-                'username': None,
-                'password': None,
-                'base_topic': 'tuya2mqtt',
-                'discovery_prefix': 'homeassistant'
-            },
-            'web': {
-                'enabled': True,
-                'port': 8099
-            },
-            'database': {
-                'enabled': True,
-                'path': 'tuya2mqtt.db'
-            },
-            'discovery': {
-                'enabled': False,
-                'network': '192.168.1.0/24',
-                'save_discovered': True
-            },
-            'poll_interval': 30,
-            'homeassistant': {
-                'enabled': True
-            },
-            'devices': {
-                'bf1234567890abcdef': {
-                    'name': 'Chytré světlo',
-                    'ip': '192.168.1.100',
-                    'local_key': 'your_local_key',
-                    'version': '3.3',
-                    'entities': [
-                        {
-                            'platform': 'light',
-                            'name': 'main_light',
-                            'friendly_name': 'Hlavní světlo',
-                            'dps': {'switch': 1, 'brightness': 2, 'color_temp': 3},
-                            'brightness_range': [10, 1000],
-                            'color_temp_range': [0, 1000],
-                            'icon': 'mdi:lightbulb'
-                        }
-                    ]
-                },
-                'climate_device_id': {
-                    'name': 'Termostat',
-                    'ip': '192.168.1.101',
-                    'local_key': 'your_key',
-                    'version': '3.3',
-                    'entities': [
-                        {
-                            'platform': 'climate',
-                            'name': 'thermostat',
-                            'friendly_name': 'Termostat',
-                            'dps': {
-                                'switch': 1,
-                                'current_temp': 2,
-                                'target_temp': 3,
-                                'mode': 4,
-                                'fan_mode': 5
-                            },
-                            'temperature_unit': 'C',
-                            'temp_range': [16, 30],
-                            'temp_step': 0.5,
-                            'modes': ['off', 'heat', 'cool', 'auto'],
-                            'fan_modes': ['auto', 'low', 'medium', 'high'],
-                            'icon': 'mdi:thermostat'
-                        }
-                    ]
-                },
-                'alarm_device_id': {
-                    'name': 'Alarm',
-                    'ip': '192.168.1.102',
-                    'local_key': 'your_key',
-                    'version': '3.3',
-                    'entities': [
-                        {
-                            'platform': 'alarm_control_panel',
-                            'name': 'alarm',
-                            'friendly_name': 'Domácí alarm',
-                            'dps': {
-                                'state': 1,
-                                'mode': 2
-                            },
-                            'states': {
-                                'disarmed': 'disarmed',
-                                'armed_home': 'home',
-                                'armed_away': 'away',
-                                'triggered': 'sos'
-                            },
-                            'icon': 'mdi:shield-home'
-                        }
-                    ]
-                },
-                'vacuum_device_id': {
-                    'name': 'Robotický vysavač',
-                    'ip': '192.168.1.103',
-                    'local_key': 'your_key',
-                    'version': '3.3',
-                    'entities': [
-                        {
-                            'platform': 'vacuum',
-                            'name': 'vacuum',
-                            'friendly_name': 'Vysavač',
-                            'dps': {
-                                'power': 1,
-                                'mode': 2,
-                                'direction': 3,
-                                'battery': 4,
-                                'status': 5
-                            },
-                            'modes': ['auto', 'spot', 'edge', 'single_room'],
-                            'icon': 'mdi:robot-vacuum'
-                        }
-                    ]
-                },
-                'lock_device_id': {
-                    'name': 'Chytrý zámek',
-                    'ip': '192.168.1.104',
-                    'local_key': 'your_key',
-                    'version': '3.3',
-                    'entities': [
-                        {
-                            'platform': 'lock',
-                            'name': 'door_lock',
-                            'friendly_name': 'Zámek dveří',
-                            'dps': {
-                                'lock': 1,
-                                'battery': 2
-                            },
-                            'icon': 'mdi:door-closed-lock'
-                        }
-                    ]
-                },
-                'camera_device_id': {
-                    'name': 'Kamera',
-                    'ip': '192.168.1.105',
-                    'local_key': 'your_key',
-                    'version': '3.3',
-                    'entities': [
-                        {
-                            'platform': 'camera',
-                            'name': 'camera',
-                            'friendly_name': 'Vstupní kamera',
-                            'dps': {
-                                'power': 1,
-                                'motion_detect': 2,
-                                'night_vision': 3
-                            },
-                            'stream_url': 'rtsp://192.168.1.105:554/stream',
-                            'icon': 'mdi:cctv'
-                        }
-                    ]
-                },
-                'humidifier_device_id': {
-                    'name': 'Zvlhčovač',
-                    'ip': '192.168.1.106',
-                    'local_key': 'your_key',
-                    'version': '3.3',
-                    'entities': [
-                        {
-                            'platform': 'humidifier',
-                            'name': 'humidifier',
-                            'friendly_name': 'Zvlhčovač vzduchu',
-                            'dps': {
-                                'switch': 1,
-                                'mode': 2,
-                                'humidity': 3,
-                                'target_humidity': 4
-                            },
-                            'modes': ['auto', 'low', 'medium', 'high'],
-                            'humidity_range': [30, 80],
-                            'icon': 'mdi:air-humidifier'
-                        }
-                    ]
-                }
-            }
-        }
-        
-        with open('config.example.yaml', 'w', encoding='utf-8') as f:
-            yaml.dump(example_config, f, default_flow_style=False, allow_unicode=True)
+        example_file = Path('config.example.yaml')
+        data = _EXAMPLE_CONFIG_YAML.encode('utf-8')
+        try:
+            if example_file.read_bytes() == data:
+                logger.info("config.example.yaml with all platform examples already exists")
+                return
+        except FileNotFoundError:
+            pass
+        example_file.write_bytes(data)
         logger.info("Created config.example.yaml with all platform examples")
@@ -1,13 +1,99 @@
 """SQLite database for persistent state storage"""
 
 import sqlite3
-import json
 import logging
-from datetime import datetime
-from typing import Dict, Any, Optional, List
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, Optional, List, Tuple, Iterator
+
+from jsonutil import dumps, loads as _loads
 
 logger = logging.getLogger(__name__)
 
+# JSON columns are stored as text
+def _dumps(obj: Any) -> str:
+    return dumps(obj).decode()
+
+# History older than this is trimmed automatically
+HISTORY_RETENTION_DAYS = 30
+
+# Free pages the file may hold before they are returned to the filesystem
+VACUUM_MIN_FREE_PAGES = 1000
+
+# Statements kept as module constants so sqlite3's statement cache is hit
+_SQL_INSERT_DEVICE = '''
+    INSERT OR REPLACE INTO devices (device_id, name, ip, version, last_seen, available, config)
+    VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, 1, ?)
+'''
+_SQL_INSERT_ENTITY = '''
+    INSERT OR REPLACE INTO entity_states 
+    (entity_id, device_id, platform, state_kind, state_num, state_text, attributes, last_updated)
+    VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+'''
+_SQL_INSERT_HISTORY = '''
+    INSERT INTO state_history (entity_id, state_kind, state_num, state_text, attributes)
+    VALUES (?, ?, ?, ?, ?)
+'''
+_SQL_INSERT_EVENT = '''
+    INSERT INTO events (device_id, event_type, data)
+    VALUES (?, ?, ?)
+'''
+_SQL_SELECT_ENTITY = 'SELECT * FROM entity_states WHERE entity_id = ?'
+_SQL_SELECT_HISTORY = '''
+    SELECT * FROM state_history 
+    WHERE entity_id = ? 
+    ORDER BY timestamp DESC 
+    LIMIT ?
+'''
+
+# How a state value is stored: scalars go to typed columns, anything else
+# is JSON-encoded into state_text
+_KIND_BOOL = 0
+_KIND_INT = 1
+_KIND_FLOAT = 2
+_KIND_STR = 3
+_KIND_JSON = 4
+_STATE_KINDS = {bool: _KIND_BOOL, int: _KIND_INT, float: _KIND_FLOAT, str: _KIND_STR}
+
+# Typed state columns added to entity_states and state_history
+_STATE_COLUMNS = (
+    ('state_kind', 'INTEGER'),
+    ('state_num', 'REAL'),
+    ('state_text', 'TEXT'),
+)
+
+
+def _encode_state(state: Any) -> Tuple[int, Optional[float], Optional[str]]:
+    """Encode a state value as (state_kind, state_num, state_text)"""
+    kind = _STATE_KINDS.get(type(state))
+    if kind is None:
+        return _KIND_JSON, None, _dumps(state)
+    if kind == _KIND_STR:
+        return kind, None, state
+    return kind, state, None
+
+
+def _decode_state(row: sqlite3.Row) -> Any:
+    """Decode the state value of an entity_states or state_history row"""
+    kind = row['state_kind']
+    if kind is None:
+        # Row written before the typed columns existed
+        return _loads(row['state']) if row['state'] is not None else None
+    if kind == _KIND_BOOL:
+        return bool(row['state_num'])
+    if kind == _KIND_INT:
+        return int(row['state_num'])
+    if kind == _KIND_FLOAT:
+        return row['state_num']
+    if kind == _KIND_STR:
+        return row['state_text']
+    return _loads(row['state_text'])
+
+
+def _decode_attributes(value: Optional[str]) -> Dict[str, Any]:
+    """Decode attributes, stored as NULL when empty"""
+    return _loads(value) if value else {}
+
 
 class Database:
     """Manages SQLite database for device states and history"""
@@ -15,14 +101,31 @@ class Database:
     def __init__(self, db_path: str = 'tuya2mqtt.db'):
         self.db_path = db_path
         self.conn = None
+        self._in_tx = False
+        # Devices are polled from several threads sharing this connection
+        self._lock = threading.RLock()
         self.init_database()
     
     def init_database(self):
         """Initialize database schema"""
         try:
-            self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self.conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                                        cached_statements=256)
             self.conn.row_factory = sqlite3.Row
             
+            # Only takes effect on a fresh database, before any table exists
+            # or the journal mode is switched
+            self.conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            
+            # WAL journaling with relaxed sync keeps the frequent poll-driven
+            # commits from each forcing a full fsync
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.execute('PRAGMA temp_store=MEMORY')
+            self.conn.execute('PRAGMA mmap_size=268435456')
+            self.conn.execute('PRAGMA cache_size=-64000')
+            self.conn.execute('PRAGMA wal_autocheckpoint=1000')
+            
             cursor = self.conn.cursor()
             
             # Devices table
@@ -32,7 +135,7 @@ class Database:
                     name TEXT NOT NULL,
                     ip TEXT NOT NULL,
                     version TEXT,
-                    last_seen TIMESTAMP,
+                    last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     available INTEGER DEFAULT 1,
                     config TEXT
                 )
@@ -45,8 +148,11 @@ class Database:
                     device_id TEXT NOT NULL,
                     platform TEXT NOT NULL,
                     state TEXT,
+                    state_kind INTEGER,
+                    state_num REAL,
+                    state_text TEXT,
                     attributes TEXT,
-                    last_updated TIMESTAMP,
+                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (device_id) REFERENCES devices(device_id)
                 )
             ''')
@@ -57,6 +163,9 @@ class Database:
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     entity_id TEXT NOT NULL,
                     state TEXT,
+                    state_kind INTEGER,
+                    state_num REAL,
+                    state_text TEXT,
                     attributes TEXT,
                     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                     FOREIGN KEY (entity_id) REFERENCES entity_states(entity_id)
@@ -74,65 +183,123 @@ class Database:
                 )
             ''')
             
-            # Create indexes
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_state_history_entity ON state_history(entity_id)')
+            # Add typed state columns to databases created before they existed
+            for table in ('entity_states', 'state_history'):
+                self._add_missing_columns(cursor, table, _STATE_COLUMNS)
+            
+            # Trim old history and events every 1000 inserts so they stay
+            # bounded between manual cleanups
+            for table in ('state_history', 'events'):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trim_{table}
+                    AFTER INSERT ON {table}
+                    WHEN NEW.id % 1000 = 0
+                    BEGIN
+                        DELETE FROM {table}
+                        WHERE timestamp < datetime('now', '-{HISTORY_RETENTION_DAYS} days');
+                    END
+                ''')
+            
+            # Create indexes; per-entity/device lookups are ordered by time, the
+            # timestamp-only indexes serve history cleanup
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_state_history_entity_ts ON state_history(entity_id, timestamp DESC)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_state_history_timestamp ON state_history(timestamp)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_device ON events(device_id)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_device_ts ON events(device_id, timestamp DESC)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events(timestamp)')
             
+            # Superseded by the composite indexes above
+            cursor.execute('DROP INDEX IF EXISTS idx_state_history_entity')
+            cursor.execute('DROP INDEX IF EXISTS idx_events_device')
+            
             self.conn.commit()
             logger.info(f"Database initialized: {self.db_path}")
             
         except Exception as e:
             logger.error(f"Failed to initialize database: {e}")
     
-    def save_device(self, device_id: str, name: str, ip: str, version: str, config: Dict[str, Any]):
-        """Save or update device"""
+    def _add_missing_columns(self, cursor, table: str, columns):
+        """Add columns that are missing from an existing table"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row['name'] for row in cursor.fetchall()}
+        for name, column_type in columns:
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+    
+    @staticmethod
+    def dumps(obj: Any) -> str:
+        """Serialize a value to JSON the same way the database stores it"""
+        return _dumps(obj)
+    
+    def save_device(self, device_id: str, name: str, ip: str, version: str, config_json: str):
+        """Save or update device; config_json is the device config serialized by dumps()"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-                INSERT OR REPLACE INTO devices (device_id, name, ip, version, last_seen, available, config)
-                VALUES (?, ?, ?, ?, ?, 1, ?)
-            ''', (device_id, name, ip, version, datetime.now(), json.dumps(config)))
-            self.conn.commit()
+            with self._lock:
+                cursor = self.conn.cursor()
+                cursor.execute(_SQL_INSERT_DEVICE, (device_id, name, ip, version, config_json))
+                self._commit()
         except Exception as e:
             logger.error(f"Failed to save device: {e}")
     
     def save_entity_state(self, entity_id: str, device_id: str, platform: str, 
                          state: Any, attributes: Dict[str, Any]):
         """Save entity state"""
+        self.save_entity_states([(entity_id, device_id, platform, state, attributes)])
+    
+    def save_entity_states(self, states: List[Tuple[str, str, str, Any, Dict[str, Any]]]) -> bool:
+        """Save several entity states as (entity_id, device_id, platform, state, attributes), returning whether they were written"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-                INSERT OR REPLACE INTO entity_states 
-                (entity_id, device_id, platform, state, attributes, last_updated)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (entity_id, device_id, platform, json.dumps(state), 
-                  json.dumps(attributes), datetime.now()))
-            
-            # Save to history
-            cursor.execute('''
-                INSERT INTO state_history (entity_id, state, attributes)
-                VALUES (?, ?, ?)
-            ''', (entity_id, json.dumps(state), json.dumps(attributes)))
+            rows = []
+            history_rows = []
+            for entity_id, device_id, platform, state, attributes in states:
+                kind, num, text = _encode_state(state)
+                attributes_json = _dumps(attributes) if attributes else None
+                rows.append((entity_id, device_id, platform, kind, num, text, attributes_json))
+                history_rows.append((entity_id, kind, num, text, attributes_json))
             
-            self.conn.commit()
+            with self._lock:
+                cursor = self.conn.cursor()
+                cursor.executemany(_SQL_INSERT_ENTITY, rows)
+                
+                # Save to history
+                cursor.executemany(_SQL_INSERT_HISTORY, history_rows)
+                
+                self._commit()
+            return True
         except Exception as e:
             logger.error(f"Failed to save entity state: {e}")
+            return False
+    
+    def begin(self):
+        """Start a batch of writes that are committed together by commit()"""
+        self._in_tx = True
+    
+    def commit(self):
+        """Commit all writes made since begin()"""
+        try:
+            with self._lock:
+                self._in_tx = False
+                self.conn.commit()
+        except Exception as e:
+            logger.error(f"Failed to commit: {e}")
+    
+    def _commit(self):
+        """Commit immediately unless a batch is in progress"""
+        if not self._in_tx:
+            self.conn.commit()
     
     def get_entity_state(self, entity_id: str) -> Optional[Dict[str, Any]]:
         """Get entity state"""
         try:
             cursor = self.conn.cursor()
-            cursor.execute('SELECT * FROM entity_states WHERE entity_id = ?', (entity_id,))
+            cursor.execute(_SQL_SELECT_ENTITY, (entity_id,))
             row = cursor.fetchone()
             if row:
                 return {
                     'entity_id': row['entity_id'],
                     'device_id': row['device_id'],
                     'platform': row['platform'],
-                    'state': json.loads(row['state']),
-                    'attributes': json.loads(row['attributes']),
+                    'state': _decode_state(row),
+                    'attributes': _decode_attributes(row['attributes']),
                     'last_updated': row['last_updated']
                 }
             return None
@@ -140,40 +307,30 @@ class Database:
             logger.error(f"Failed to get entity state: {e}")
             return None
     
-    def get_entity_history(self, entity_id: str, limit: int = 100) -> List[Dict[str, Any]]:
-        """Get entity history"""
+    def get_entity_history(self, entity_id: str, limit: int = 100) -> Iterator[Dict[str, Any]]:
+        """Get entity history, newest first, decoding rows as they are iterated"""
         try:
             cursor = self.conn.cursor()
-            cursor.execute('''
-                SELECT * FROM state_history 
-                WHERE entity_id = ? 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            ''', (entity_id, limit))
-            
-            history = []
-            for row in cursor.fetchall():
-                history.append({
+            cursor.execute(_SQL_SELECT_HISTORY, (entity_id, limit))
+            
+            for row in cursor:
+                yield {
                     'id': row['id'],
                     'entity_id': row['entity_id'],
-                    'state': json.loads(row['state']),
-                    'attributes': json.loads(row['attributes']),
+                    'state': _decode_state(row),
+                    'attributes': _decode_attributes(row['attributes']),
                     'timestamp': row['timestamp']
-                })
-            return history
+                }
         except Exception as e:
             logger.error(f"Failed to get entity history: {e}")
-            return []
     
     def log_event(self, device_id: str, event_type: str, data: Dict[str, Any]):
         """Log an event"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-                INSERT INTO events (device_id, event_type, data)
-                VALUES (?, ?, ?)
-            ''', (device_id, event_type, json.dumps(data)))
-            self.conn.commit()
+            with self._lock:
+                cursor = self.conn.cursor()
+                cursor.execute(_SQL_INSERT_EVENT, (device_id, event_type, _dumps(data)))
+                self._commit()
         except Exception as e:
             logger.error(f"Failed to log event: {e}")
     
@@ -204,20 +361,35 @@ class Database:
             logger.error(f"Failed to get statistics: {e}")
             return {}
     
-    def cleanup_old_history(self, days: int = 30):
+    def incremental_vacuum(self, pages: int = 1000, min_free: int = VACUUM_MIN_FREE_PAGES):
+        """Return up to the given number of free pages to the filesystem, once enough are free"""
+        try:
+            with self._lock:
+                # executescript() would commit a batch in progress
+                if self._in_tx:
+                    return
+                if self.conn.execute('PRAGMA freelist_count').fetchone()[0] < min_free:
+                    return
+                # execute() steps the pragma once, freeing a single page;
+                # executescript() runs it to completion
+                self.conn.executescript(f'PRAGMA incremental_vacuum({int(pages)});')
+        except Exception as e:
+            logger.error(f"Failed to vacuum database: {e}")
+    
+    def cleanup_old_history(self, days: int = HISTORY_RETENTION_DAYS):
         """Clean up old history records"""
         try:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-                DELETE FROM state_history 
-                WHERE timestamp < datetime('now', '-' || ? || ' days')
-            ''', (days,))
-            cursor.execute('''
-                DELETE FROM events 
-                WHERE timestamp < datetime('now', '-' || ? || ' days')
-            ''', (days,))
-            self.conn.commit()
+            # Timestamps are stored by CURRENT_TIMESTAMP (UTC); a bound cutoff
+            # lets SQLite range-scan the timestamp indexes
+            cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+            with self._lock:
+                cursor = self.conn.cursor()
+                cursor.execute('DELETE FROM state_history WHERE timestamp < ?', (cutoff,))
+                cursor.execute('DELETE FROM events WHERE timestamp < ?', (cutoff,))
+                # Committed right away, along with any poll batch in progress
+                self.conn.commit()
             logger.info(f"Cleaned up history older than {days} days")
+            self.incremental_vacuum(min_free=1)
         except Exception as e:
             logger.error(f"Failed to cleanup history: {e}")
     
@@ -1,13 +1,20 @@
 """Device management with extended platform support"""
 
+import asyncio
+import bisect
 import logging
 import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
 from typing import Dict, Any, Optional, Callable
 from datetime import datetime
 
 import tinytuya
 
+from homeassistant import HomeAssistantDiscovery
+
 logger = logging.getLogger(__name__)
 
 SUPPORTED_PLATFORMS = [
@@ -17,16 +24,60 @@ SUPPORTED_PLATFORMS = [
     'button', 'number', 'select'
 ]
 
+# Platforms whose main state is a plain on/off value
+ON_OFF_PLATFORMS = frozenset(['light', 'switch', 'fan', 'lock'])
+
+
+def _on_off_state(state: Dict[str, Any], entity: 'Entity') -> Any:
+    return state.get('switch', False) or state.get('lock', False)
+
+
+# Main state value getters keyed by platform
+_STATE_GETTERS: Dict[str, Callable[[Dict[str, Any], 'Entity'], Any]] = {
+    **{platform: _on_off_state for platform in ON_OFF_PLATFORMS},
+    'sensor': lambda s, e: s.get('value', 0),
+    'number': lambda s, e: s.get('value', 0),
+    'binary_sensor': lambda s, e: s.get('state', False),
+    'cover': lambda s, e: s.get('position', 0),
+    'climate': lambda s, e: s.get('current_temp', 20),
+    'alarm_control_panel': lambda s, e: s.get('state', 'disarmed'),
+    'vacuum': lambda s, e: s.get('status', 'docked'),
+    'select': lambda s, e: s.get('option', e.options[0] if e.options else ''),
+}
+
+
+# Shared immutable defaults for entity attributes missing from the config
+_EMPTY_TUPLE = ()
+_EMPTY_MAPPING = MappingProxyType({})
+_DEFAULT_BRIGHTNESS_RANGE = (10, 1000)
+_DEFAULT_COLOR_TEMP_RANGE = (0, 1000)
+_DEFAULT_SPEED_RANGE = (1, 3)
+_DEFAULT_TEMP_RANGE = (16, 30)
+_DEFAULT_POSITION_RANGE = (0, 100)
+_DEFAULT_HUMIDITY_RANGE = (30, 80)
+
 
 class Entity:
     """Represents a Home Assistant entity with DPS mapping"""
     
+    __slots__ = (
+        'device_id', 'platform', 'name', 'entity_id', 'friendly_name', 'dps_map', '_dps_items', 'icon',
+        'unit_of_measurement', 'device_class', 'scale',
+        'brightness_range', 'color_temp_range', 'speed_range',
+        'temperature_unit', 'temp_range', 'temp_step', 'modes', 'fan_modes',
+        'states', 'position_range', 'min_value', 'max_value', 'step', 'options',
+        'stream_url', 'humidity_range', 'state', '_saved_state', '_state_version', '_dict', '_dict_version',
+        'mqtt_topic_prefix', 'mqtt_state_topic'
+    )
+    
     def __init__(self, device_id: str, entity_config: Dict[str, Any]):
         self.device_id = device_id
         self.platform = entity_config.get('platform', 'switch')
         self.name = entity_config.get('name', 'entity')
+        self.entity_id = f"{device_id}_{self.name}"
         self.friendly_name = entity_config.get('friendly_name', self.name)
         self.dps_map = entity_config.get('dps', {})
+        self._dps_items = tuple(self.dps_map.items())
         self.icon = entity_config.get('icon', 'mdi:help-circle')
         
         # Common attributes
@@ -35,89 +86,95 @@ class Entity:
         self.scale = entity_config.get('scale', 1.0)
         
         # Light/Fan attributes
-        self.brightness_range = entity_config.get('brightness_range', [10, 1000])
-        self.color_temp_range = entity_config.get('color_temp_range', [0, 1000])
-        self.speed_range = entity_config.get('speed_range', [1, 3])
+        self.brightness_range = entity_config.get('brightness_range', _DEFAULT_BRIGHTNESS_RANGE)
+        self.color_temp_range = entity_config.get('color_temp_range', _DEFAULT_COLOR_TEMP_RANGE)
+        self.speed_range = entity_config.get('speed_range', _DEFAULT_SPEED_RANGE)
         
         # Climate attributes
         self.temperature_unit = entity_config.get('temperature_unit', 'C')
-        self.temp_range = entity_config.get('temp_range', [16, 30])
+        self.temp_range = entity_config.get('temp_range', _DEFAULT_TEMP_RANGE)
         self.temp_step = entity_config.get('temp_step', 0.5)
-        self.modes = entity_config.get('modes', [])
-        self.fan_modes = entity_config.get('fan_modes', [])
+        self.modes = entity_config.get('modes', _EMPTY_TUPLE)
+        self.fan_modes = entity_config.get('fan_modes', _EMPTY_TUPLE)
         
         # Other attributes
-        self.states = entity_config.get('states', {})
-        self.position_range = entity_config.get('position_range', [0, 100])
+        self.states = entity_config.get('states', _EMPTY_MAPPING)
+        self.position_range = entity_config.get('position_range', _DEFAULT_POSITION_RANGE)
         self.min_value = entity_config.get('min', 0)
         self.max_value = entity_config.get('max', 100)
         self.step = entity_config.get('step', 1)
-        self.options = entity_config.get('options', [])
+        self.options = entity_config.get('options', _EMPTY_TUPLE)
         self.stream_url = entity_config.get('stream_url')
-        self.humidity_range = entity_config.get('humidity_range', [30, 80])
+        self.humidity_range = entity_config.get('humidity_range', _DEFAULT_HUMIDITY_RANGE)
         
         self.state = {}
+        # Last state written to the database, to skip unchanged writes
+        self._saved_state = None
+        # Bumped when the state changes; to_dict() is rebuilt only after that
+        self._state_version = 0
+        self._dict = None
+        self._dict_version = -1
+        
+        # MQTT topics, assigned by TuyaDevice.assign_topics()
+        self.mqtt_topic_prefix = None
+        self.mqtt_state_topic = None
         
-    @property
-    def entity_id(self) -> str:
-        """Generate entity ID"""
-        return f"{self.device_id}_{self.name}"
-    
     def get_dps(self, key: str) -> Optional[int]:
         """Get DPS number for a key"""
         return self.dps_map.get(key)
     
     def update_state(self, dps_values: Dict[int, Any]):
         """Update entity state from DPS values"""
-        self.state = {}
+        state = {}
+        scale = self.scale
         
-        for key, dps_num in self.dps_map.items():
-            if dps_num in dps_values:
-                value = dps_values[dps_num]
-                
-                if self.scale != 1.0 and isinstance(value, (int, float)):
-                    value = value * self.scale
-                
-                self.state[key] = value
+        for key, dps_num in self._dps_items:
+            value = dps_values.get(dps_num)
+            if value is None:
+                continue
+            
+            if scale != 1.0 and isinstance(value, (int, float)):
+                value = value * scale
+            
+            state[key] = value
+        
+        if state != self.state:
+            self.state = state
+            self._state_version += 1
     
     def get_state_value(self) -> Any:
         """Get main state value based on platform"""
-        if self.platform in ['light', 'switch', 'fan', 'lock']:
-            return self.state.get('switch', False) or self.state.get('lock', False)
-        elif self.platform in ['sensor', 'number']:
-            return self.state.get('value', 0)
-        elif self.platform == 'binary_sensor':
-            return self.state.get('state', False)
-        elif self.platform == 'cover':
-            return self.state.get('position', 0)
-        elif self.platform == 'climate':
-            return self.state.get('current_temp', 20)
-        elif self.platform == 'alarm_control_panel':
-            return self.state.get('state', 'disarmed')
-        elif self.platform == 'vacuum':
-            return self.state.get('status', 'docked')
-        elif self.platform == 'select':
-            return self.state.get('option', self.options[0] if self.options else '')
-        return None
+        getter = _STATE_GETTERS.get(self.platform)
+        return getter(self.state, self) if getter else None
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert entity to dictionary"""
-        return {
-            'entity_id': self.entity_id,
-            'platform': self.platform,
-            'name': self.name,
-            'friendly_name': self.friendly_name,
-            'icon': self.icon,
-            'state': self.state,
-            'dps_map': self.dps_map,
-            'unit_of_measurement': self.unit_of_measurement,
-            'device_class': self.device_class
-        }
+        version = self._state_version
+        if self._dict_version != version:
+            self._dict = {
+                'entity_id': self.entity_id,
+                'platform': self.platform,
+                'name': self.name,
+                'friendly_name': self.friendly_name,
+                'icon': self.icon,
+                'state': self.state,
+                'dps_map': self.dps_map,
+                'unit_of_measurement': self.unit_of_measurement,
+                'device_class': self.device_class
+            }
+            self._dict_version = version
+        return self._dict
 
 
 class TuyaDevice:
     """Represents a Tuya device with entities"""
     
+    __slots__ = (
+        'device_id', 'name', 'ip', 'local_key', 'version', 'database', '_config_json', 'device',
+        'entities', '_entity_index', '_name_index', '_mapped_dps', 'last_state', 'last_update', 'available', 'state_version',
+        'on_status', 'availability_topic', 'raw_state_topic'
+    )
+    
     def __init__(self, device_id: str, config: Dict[str, Any], database=None):
         self.device_id = device_id
         self.name = config.get('name', device_id)
@@ -138,13 +195,43 @@ class TuyaDevice:
         for entity_config in config.get('entities', []):
             entity = Entity(device_id, entity_config)
             self.entities.append(entity)
+        # Built in reverse so a duplicate ID resolves to its first entity, as a scan would
+        self._entity_index = {e.entity_id: e for e in reversed(self.entities)}
+        # Entity IDs are "<device_id>_<name>", so commands can look up the name as is;
+        # first wins for duplicate names like the ID index
+        self._name_index = {e.name: e for e in reversed(self.entities)}
+        # DPS numbers used by any entity, fixed by the config
+        self._mapped_dps = frozenset(
+            dps_num for e in self.entities for dps_num in e.dps_map.values() if dps_num is not None
+        )
         
         self.last_state = {}
         self.last_update = None
         self.available = True
+        # Bumped after every status update, so cached views can tell they are stale
+        self.state_version = 0
+        # Called with the device after every status update
+        self.on_status = None
         
+        # MQTT topics, assigned by assign_topics()
+        self.availability_topic = None
+        self.raw_state_topic = None
+        
+        # The device config does not change at runtime, so serialize it once
+        self._config_json = None
         if self.database:
-            self.database.save_device(device_id, self.name, self.ip, self.version, config)
+            self._config_json = self.database.dumps(config)
+            self.database.save_device(device_id, self.name, self.ip, self.version, self._config_json)
+    
+    def assign_topics(self, base_topic: str):
+        """Precompute the MQTT topics of the device and its entities"""
+        device_prefix = f"{base_topic}/{self.device_id}"
+        self.availability_topic = f"{device_prefix}/availability"
+        self.raw_state_topic = f"{device_prefix}/state"
+        for entity in self.entities:
+            # Topics must match the ones announced in Home Assistant discovery
+            entity.mqtt_topic_prefix = f"{device_prefix}/{HomeAssistantDiscovery.sanitize_topic(entity.entity_id)}"
+            entity.mqtt_state_topic = f"{entity.mqtt_topic_prefix}/state"
     
     def get_status(self) -> Optional[Dict[int, Any]]:
         """Get current device status"""
@@ -155,19 +242,22 @@ class TuyaDevice:
                 self.last_update = datetime.now()
                 self.available = True
                 
+                changed = []
                 for entity in self.entities:
                     entity.update_state(self.last_state)
-                    
-                    if self.database:
-                        self.database.save_entity_state(
-                            entity.entity_id,
-                            self.device_id,
-                            entity.platform,
-                            entity.get_state_value(),
-                            entity.state
-                        )
+                    if entity.state != entity._saved_state:
+                        changed.append(entity)
                 
-                if self.database:
+                # Polls that change nothing write nothing
+                if self.database and changed:
+                    # A failed write leaves _saved_state alone, so the next poll retries it
+                    if self.database.save_entity_states([
+                        (entity.entity_id, self.device_id, entity.platform,
+                         entity.get_state_value(), entity.state)
+                        for entity in changed
+                    ]):
+                        for entity in changed:
+                            entity._saved_state = entity.state
                     self.database.log_event(
                         self.device_id,
                         'state_update',
@@ -181,6 +271,10 @@ class TuyaDevice:
             logger.error(f"Error getting status for {self.name}: {e}")
             self.available = False
             return None
+        finally:
+            self.state_version += 1
+            if self.on_status:
+                self.on_status(self)
     
     def set_dps(self, dps: int, value: Any) -> bool:
         """Set a DPS value"""
@@ -202,6 +296,11 @@ class TuyaDevice:
     
     def set_multiple_dps(self, values: Dict[int, Any]) -> bool:
         """Set multiple DPS values"""
+        if len(values) == 1:
+            # A single value goes out as a plain set
+            (dps, value), = values.items()
+            return self.set_dps(dps, value)
+        
         try:
             result = self.device.set_multiple_values(values)
             logger.info(f"Set multiple DPS for {self.name}")
@@ -220,28 +319,19 @@ class TuyaDevice:
     
     def get_entity_by_id(self, entity_id: str) -> Optional[Entity]:
         """Get entity by ID"""
-        for entity in self.entities:
-            if entity.entity_id == entity_id:
-                return entity
-        return None
+        return self._entity_index.get(entity_id)
+    
+    def get_entity_by_name(self, name: str) -> Optional[Entity]:
+        """Get entity by its name within the device"""
+        return self._name_index.get(name)
     
     def _get_unmapped_dps(self) -> Dict[int, Any]:
         """Get DPS values that are not mapped to any entity"""
         if not self.last_state:
             return {}
         
-        mapped_dps = set()
-        for entity in self.entities:
-            for dps_num in entity.dps_map.values():
-                if dps_num is not None:
-                    mapped_dps.add(dps_num)
-        
-        unmapped = {}
-        for dps_num, value in self.last_state.items():
-            if dps_num not in mapped_dps:
-                unmapped[dps_num] = value
-        
-        return unmapped
+        mapped_dps = self._mapped_dps
+        return {dps_num: value for dps_num, value in self.last_state.items() if dps_num not in mapped_dps}
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert device to dictionary"""
@@ -257,6 +347,78 @@ class TuyaDevice:
         }
 
 
+class AdaptivePollSchedule:
+    """Poll schedule of one device, fitted to its observed state changes
+    
+    Uses the fixed interval until enough changes have been seen. After that,
+    poll times after the last change follow the recurrence
+    L_i = L_{i-1} + (F(L_{i-1}) - F(L_{i-2})) / p(L_{i-1})
+    over the empirical distribution of times between changes, so polls are
+    dense where a change is likely and sparse where it is not.
+    """
+    
+    MIN_SAMPLES = 20
+    MAX_SAMPLES = 200
+    MAX_OFFSETS = 64
+    
+    def __init__(self, interval: float, min_interval: float, max_interval: float):
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._samples = deque(maxlen=self.MAX_SAMPLES)
+        self._last_change = None
+        self._offsets = None
+    
+    def record(self, now: float, changed: bool):
+        """Record the outcome of a poll at monotonic time `now`"""
+        if not changed:
+            return
+        if self._last_change is not None:
+            self._samples.append(now - self._last_change)
+            self._offsets = None
+        self._last_change = now
+    
+    def next_delay(self, now: float) -> float:
+        """Get the time to wait before polling again"""
+        if len(self._samples) < self.MIN_SAMPLES:
+            return self.interval
+        if self._offsets is None:
+            self._offsets = self._fit()
+        
+        since_change = now - self._last_change
+        i = bisect.bisect_right(self._offsets, since_change)
+        if i == len(self._offsets):
+            return self.max_interval
+        return min(max(self._offsets[i] - since_change, self.min_interval), self.max_interval)
+    
+    def _fit(self) -> list:
+        """Compute the poll times after a change from the sampled intervals"""
+        samples = sorted(self._samples)
+        n = len(samples)
+        width = max(self.min_interval, (samples[-1] - samples[0]) / n ** 0.5)
+        
+        def cdf(t):
+            return bisect.bisect_right(samples, t) / n
+        
+        def density(t):
+            inside = bisect.bisect_left(samples, t + width / 2) - bisect.bisect_left(samples, t - width / 2)
+            return inside / (n * width)
+        
+        offsets = [self.min_interval]
+        previous = 0.0
+        while len(offsets) < self.MAX_OFFSETS and offsets[-1] < samples[-1]:
+            current = offsets[-1]
+            p = density(current)
+            if p:
+                step = (cdf(current) - cdf(previous)) / p
+            else:
+                # No change expected here, skip ahead to the next observed interval
+                step = samples[bisect.bisect_right(samples, current)] - current
+            previous = current
+            offsets.append(current + min(max(step, self.min_interval), self.max_interval))
+        return offsets
+
+
 class DeviceManager:
     """Manages all Tuya devices"""
     
@@ -264,8 +426,17 @@ class DeviceManager:
         self.config_manager = config_manager
         self.database = database
         self.devices: Dict[str, TuyaDevice] = {}
+        # Entities of all devices, counted once they are initialized
+        self.entity_count = 0
         self.poll_thread = None
         self.polling = False
+        self._executor = None
+        self._loop = None
+        # Poll schedules and next poll time (monotonic) per device ID
+        self._schedules: Dict[str, AdaptivePollSchedule] = {}
+        self._next_poll: Dict[str, float] = {}
+        # Callbacks run with a device after each of its status updates
+        self._state_listeners: list = []
     
     def initialize_devices(self):
         """Initialize all devices from config"""
@@ -274,10 +445,37 @@ class DeviceManager:
         for device_id, device_config in device_configs.items():
             try:
                 device = TuyaDevice(device_id, device_config, self.database)
+                device.on_status = self._notify_state_listeners
                 self.devices[device_id] = device
                 logger.info(f"Initialized device: {device.name} with {len(device.entities)} entities")
             except Exception as e:
                 logger.error(f"Failed to initialize device {device_id}: {e}")
+        
+        self.entity_count = sum(len(device.entities) for device in self.devices.values())
+        self.assign_topics(self.config_manager.mqtt.base_topic)
+        
+        # Devices are polled concurrently, one worker per device
+        self._executor = ThreadPoolExecutor(
+            max_workers=min(32, len(self.devices) or 1),
+            thread_name_prefix='tuya-poll'
+        )
+    
+    def assign_topics(self, base_topic: str):
+        """Precompute the MQTT topics of all devices under `base_topic`"""
+        for device in self.devices.values():
+            device.assign_topics(base_topic)
+    
+    def add_state_listener(self, callback: Callable):
+        """Call `callback(device)` after every device status update"""
+        self._state_listeners.append(callback)
+    
+    def _notify_state_listeners(self, device: TuyaDevice):
+        """Run the state listeners for a device"""
+        for callback in self._state_listeners:
+            try:
+                callback(device)
+            except Exception as e:
+                logger.error(f"Error in state listener for {device.device_id}: {e}")
     
     def get_device(self, device_id: str) -> Optional[TuyaDevice]:
         """Get device by ID"""
@@ -306,14 +504,109 @@ class DeviceManager:
         self.polling = False
         if self.poll_thread:
             self.poll_thread.join(timeout=5)
+        if self._executor:
+            self._executor.shutdown(wait=False)
+    
+    def call_later(self, delay: float, callback: Callable, *args):
+        """Run a blocking callback on the device workers after `delay` seconds
+        
+        Scheduled on the polling event loop, so device I/O triggered from other
+        threads shares the polling workers instead of needing its own.
+        """
+        loop = self._loop
+        if loop is None or not self.polling:
+            # Polling not running yet, use a one-off timer thread
+            timer = threading.Timer(delay, callback, args)
+            timer.daemon = True
+            timer.start()
+            return
+        asyncio.run_coroutine_threadsafe(self._run_later(delay, callback, args), loop)
+    
+    async def _run_later(self, delay: float, callback: Callable, args: tuple):
+        """Sleep, then run a blocking callback on the device workers"""
+        await asyncio.sleep(delay)
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, callback, *args)
+        except Exception as e:
+            logger.error(f"Error in delayed device callback: {e}")
     
     def _poll_loop(self, publish_callback: Callable, interval: int):
+        """Polling thread entry point, running the asyncio poll loop"""
+        asyncio.run(self._poll_forever(publish_callback, interval))
+    
+    async def _poll_forever(self, publish_callback: Callable, interval: int):
         """Polling loop"""
+        self._loop = asyncio.get_running_loop()
+        try:
+            await self._poll_cycles(publish_callback, interval)
+        finally:
+            self._loop = None
+    
+    async def _poll_cycles(self, publish_callback: Callable, interval: int):
+        """Poll devices as they become due while polling is enabled"""
+        settings = self.config_manager.adaptive_polling
+        if settings.enabled:
+            self._schedules = {
+                device_id: AdaptivePollSchedule(interval, settings.min_interval, settings.max_interval)
+                for device_id in self.devices
+            }
+            logger.info(f"Adaptive polling between {settings.min_interval}s and {settings.max_interval}s")
+        else:
+            self._schedules = {}
+        self._next_poll = {}
+        
         while self.polling:
-            for device in self.devices.values():
-                try:
-                    device.get_status()
-                    publish_callback(device)
-                except Exception as e:
-                    logger.error(f"Error polling device {device.device_id}: {e}")
-            time.sleep(interval)
\ No newline at end of file
+            now = time.monotonic()
+            due = [
+                device for device_id, device in self.devices.items()
+                if self._next_poll.get(device_id, 0) <= now
+            ]
+            
+            # Commit all state writes of one poll cycle at once
+            if self.database:
+                self.database.begin()
+            try:
+                await self.poll_all(publish_callback, due)
+            finally:
+                if self.database:
+                    self.database.commit()
+                    self.database.incremental_vacuum()
+            
+            now = time.monotonic()
+            for device in due:
+                self._next_poll[device.device_id] = now + self._next_delay(device, now, interval)
+            await asyncio.sleep(max(min(self._next_poll.values(), default=now + interval) - now, 0))
+    
+    def _next_delay(self, device: TuyaDevice, now: float, interval: float) -> float:
+        """Get the time until a device is polled again, falling back to the fixed interval"""
+        schedule = self._schedules.get(device.device_id)
+        if not schedule:
+            return interval
+        # A failed fit must not end the poll loop
+        try:
+            return schedule.next_delay(now)
+        except Exception as e:
+            logger.error(f"Adaptive poll schedule failed for {device.device_id}: {e}")
+            return interval
+    
+    async def poll_all(self, publish_callback: Callable, devices: Optional[list] = None):
+        """Poll devices concurrently (all by default) and publish their state"""
+        loop = asyncio.get_running_loop()
+        if devices is None:
+            devices = list(self.devices.values())
+        await asyncio.gather(*(
+            loop.run_in_executor(self._executor, self._poll_one, device, publish_callback)
+            for device in devices
+        ))
+    
+    def _poll_one(self, device: TuyaDevice, publish_callback: Callable):
+        """Poll a single device and publish its state"""
+        try:
+            previous_state = device.last_state
+            device.get_status()
+            schedule = self._schedules.get(device.device_id)
+            if schedule:
+                schedule.record(time.monotonic(), device.last_state != previous_state)
+            publish_callback(device)
+        except Exception as e:
+            logger.error(f"Error polling device {device.device_id}: {e}")
\ No newline at end of file
@@ -1,11 +1,43 @@
 """Automatic Tuya device discovery"""
 
+import asyncio
+import hashlib
+import json
 import logging
-from typing import List, Dict, Any
+import os
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Dict, Any, Iterator, Optional, Set
 import tinytuya
 
 logger = logging.getLogger(__name__)
 
+# UDP ports Tuya devices broadcast on: 3.1 plaintext, 3.3+ encrypted, app
+DISCOVERY_PORTS = (tinytuya.UDPPORT, tinytuya.UDPPORTS, tinytuya.UDPPORTAPP)
+
+# Receive buffer for discovery sockets, room for a burst of replies on busy LANs
+DISCOVERY_RCVBUF = 2 << 20
+
+# Linux SO_BINDTODEVICE, not exported by the socket module on every Python
+SO_BINDTODEVICE = getattr(socket, 'SO_BINDTODEVICE', 25)
+
+# Busy polling for the short scan window when pinned to the NIC's CPU (Linux 5.11+)
+SO_BUSY_POLL = getattr(socket, 'SO_BUSY_POLL', 46)
+SO_PREFER_BUSY_POLL = getattr(socket, 'SO_PREFER_BUSY_POLL', 69)
+DISCOVERY_BUSY_POLL_US = 50
+
+
+class _BroadcastProtocol(asyncio.DatagramProtocol):
+    """Hands every datagram received on a discovery port to a callback"""
+    
+    def __init__(self, on_packet):
+        self.on_packet = on_packet
+    
+    def datagram_received(self, data, addr):
+        self.on_packet(data, addr)
+
 
 class DeviceDiscovery:
     """Handles automatic discovery of Tuya devices"""
@@ -14,27 +46,79 @@ class DeviceDiscovery:
         self.config_manager = config_manager
         self.device_manager = device_manager
         self.discovered_devices = []
+        self._scan_lock = threading.Lock()
+        self._scan_in_flight = None
+    
+    def scan_network_sync(self, bypass_cache: bool = False, no_cache: bool = False):
+        """Run scan_network from synchronous code
+        
+        Concurrent callers share the scan already in progress instead of
+        starting another one.
+        """
+        with self._scan_lock:
+            in_flight = self._scan_in_flight
+            if in_flight is None:
+                in_flight = self._scan_in_flight = Future()
+                owner = True
+            else:
+                owner = False
+        
+        if not owner:
+            logger.info("Discovery scan already running, waiting for its result")
+            return in_flight.result()
+        
+        try:
+            result = asyncio.run(self.scan_network(bypass_cache, no_cache))
+            in_flight.set_result(result)
+            return result
+        except BaseException as e:
+            in_flight.set_exception(e)
+            raise
+        finally:
+            with self._scan_lock:
+                self._scan_in_flight = None
     
-    def scan_network(self):
-        """Scan network for Tuya devices"""
+    async def scan_network(self, bypass_cache: bool = False, no_cache: bool = False):
+        """Scan network for Tuya devices
+        
+        A recent result cached on disk is returned instead of scanning unless
+        `bypass_cache` is set; `no_cache` skips storing the new result.
+        """
+        if not bypass_cache:
+            cached = self._load_cache()
+            if cached is not None:
+                logger.info(f"Using {len(cached)} cached discovered devices")
+                self.discovered_devices = cached
+                return cached
+        
         logger.info("Starting Tuya device discovery...")
         
         try:
-            logger.info("Scanning network for Tuya devices (this may take 20-30 seconds)...")
-            devices = tinytuya.deviceScan(False, 20)
+            settings = self.config_manager.discovery
+            
+            try:
+                devices = await self._listen_for_broadcasts(
+                    settings.timeout, settings.idle_timeout, settings.interface, settings.pin_cpu)
+            except OSError as e:
+                logger.warning(f"Cannot listen for broadcasts ({e}), falling back to tinytuya scan")
+                logger.info("Scanning network for Tuya devices (this may take 20-30 seconds)...")
+                loop = asyncio.get_running_loop()
+                devices = await loop.run_in_executor(None, tinytuya.deviceScan, False, 20)
             
             device_list = []
             
             if isinstance(devices, dict):
                 for device_id, device_info in devices.items():
                     if isinstance(device_info, dict):
+                        # tinytuya.deviceScan keys its result by IP address
+                        device_id = device_info.get('gwId', device_id)
                         device_data = {
                             'id': device_id,
                             'gwId': device_id,
                             'ip': device_info.get('ip', ''),
                             'version': device_info.get('version', '3.3'),
                             'product_id': device_info.get('productKey', ''),
-                            'encrypted': device_info.get('encrypted', False)
+                            'encrypted': device_info.get('encrypted', device_info.get('encrypt', False))
                         }
                     else:
                         device_data = {
@@ -51,6 +135,8 @@ class DeviceDiscovery:
             if device_list:
                 logger.info(f"Found {len(device_list)} Tuya devices on network")
                 self.discovered_devices = device_list
+                if not no_cache:
+                    self._save_cache(device_list)
                 return device_list
             else:
                 logger.warning("No Tuya devices found on network")
@@ -60,40 +146,228 @@ class DeviceDiscovery:
             logger.error(f"Error during device discovery: {e}", exc_info=True)
             return []
     
+    def _cache_settings(self):
+        """Get (cache file, TTL, checksum of configured device IDs)"""
+        settings = self.config_manager.discovery
+        device_ids = ','.join(sorted(self.config_manager.get_device_ids()))
+        checksum = hashlib.blake2b(device_ids.encode(), digest_size=8).hexdigest()
+        return settings.cache_file, settings.cache_ttl, checksum
+    
+    def _load_cache(self):
+        """Get cached scan results, or None if missing, expired or stale"""
+        cache_file, ttl, checksum = self._cache_settings()
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable discovery cache {cache_file}: {e}")
+            return None
+        
+        if cache.get('checksum') != checksum or time.time() - cache.get('timestamp', 0) >= ttl:
+            return None
+        return cache.get('entries', [])
+    
+    def _save_cache(self, device_list: List[Dict[str, Any]]):
+        """Persist scan results for later scans"""
+        cache_file, _, checksum = self._cache_settings()
+        try:
+            with open(cache_file, 'w', encoding='utf-8') as f:
+                json.dump({'timestamp': time.time(), 'checksum': checksum, 'entries': device_list}, f)
+        except Exception as e:
+            logger.warning(f"Failed to save discovery cache {cache_file}: {e}")
+    
+    @staticmethod
+    def _open_discovery_socket(port: int, interface: Optional[str] = None,
+                               busy_poll: bool = False) -> socket.socket:
+        """Create a non-blocking broadcast listener bound to a discovery port"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            if hasattr(socket, 'SO_REUSEPORT'):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, DISCOVERY_RCVBUF)
+            except OSError as e:
+                logger.debug(f"Cannot enlarge receive buffer on UDP port {port}: {e}")
+            if interface:
+                # Needs CAP_NET_RAW; only Linux supports it
+                sock.setsockopt(socket.SOL_SOCKET, SO_BINDTODEVICE, interface.encode())
+            if busy_poll:
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, SO_PREFER_BUSY_POLL, 1)
+                    sock.setsockopt(socket.SOL_SOCKET, SO_BUSY_POLL, DISCOVERY_BUSY_POLL_US)
+                except OSError as e:
+                    logger.debug(f"Cannot enable busy polling on UDP port {port}: {e}")
+            sock.bind(('', port))
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+    
+    @staticmethod
+    def _nic_irq_cpus(interface: str) -> Set[int]:
+        """Get the CPUs handling the interrupts of a network interface"""
+        device = f'/sys/class/net/{interface}/device'
+        try:
+            irqs = set(os.listdir(f'{device}/msi_irqs'))
+        except OSError:
+            # Without MSI, find the IRQs by interface or device name
+            names = (interface, os.path.basename(os.path.realpath(device)))
+            irqs = set()
+            try:
+                with open('/proc/interrupts') as f:
+                    for line in f:
+                        irq, _, rest = line.partition(':')
+                        fields = rest.split()
+                        if fields and fields[-1].split('-')[0] in names:
+                            irqs.add(irq.strip())
+            except OSError:
+                pass
+        
+        cpus = set()
+        for irq in irqs:
+            try:
+                with open(f'/proc/irq/{irq}/smp_affinity_list') as f:
+                    ranges = f.read().strip()
+            except OSError:
+                continue
+            for part in ranges.split(','):
+                first, _, last = part.partition('-')
+                cpus.update(range(int(first), int(last or first) + 1))
+        return cpus
+    
+    def _pin_to_nic_cpu(self, interface: Optional[str]) -> Optional[Set[int]]:
+        """Pin the calling thread to a CPU serving the NIC, returning the previous affinity"""
+        if not interface or not hasattr(os, 'sched_setaffinity'):
+            logger.warning("discovery.pin_cpu needs discovery.interface on Linux, not pinning")
+            return None
+        try:
+            previous = os.sched_getaffinity(0)
+            cpus = self._nic_irq_cpus(interface) & previous
+            if not cpus:
+                logger.warning(f"No usable IRQ CPU found for {interface}, not pinning")
+                return None
+            cpu = min(cpus)
+            os.sched_setaffinity(0, {cpu})
+            logger.info(f"Discovery pinned to CPU {cpu} serving {interface}")
+            return previous
+        except OSError as e:
+            logger.warning(f"Failed to pin discovery to {interface} CPU: {e}")
+            return None
+    
+    async def _listen_for_broadcasts(self, timeout: float, idle_timeout: float,
+                                     interface: Optional[str] = None,
+                                     pin_cpu: bool = False) -> Dict[str, Dict[str, Any]]:
+        """Listen for device broadcasts on all discovery ports at once
+        
+        Returns broadcast info keyed by device ID. Stops after `timeout`
+        seconds, or earlier once no new device appeared for `idle_timeout`.
+        Raises OSError if none of the ports can be bound. With `interface`
+        set, only broadcasts arriving on that network interface are seen;
+        `pin_cpu` additionally runs the receive loop on a CPU serving its IRQs.
+        """
+        loop = asyncio.get_running_loop()
+        devices = {}
+        new_device = asyncio.Event()
+        last_new = loop.time()
+        
+        def on_packet(data, addr):
+            nonlocal last_new
+            info = self._decode_broadcast(data)
+            device_id = info.get('gwId') if info else None
+            if device_id and device_id not in devices:
+                info.setdefault('ip', addr[0])
+                devices[device_id] = info
+                last_new = loop.time()
+                new_device.set()
+        
+        async def open_endpoint(port):
+            try:
+                sock = self._open_discovery_socket(port, interface, busy_poll=previous_affinity is not None)
+            except OSError as e:
+                logger.warning(f"Cannot listen on UDP port {port}: {e}")
+                return None
+            transport, _ = await loop.create_datagram_endpoint(
+                lambda: _BroadcastProtocol(on_packet), sock=sock)
+            return transport
+        
+        previous_affinity = self._pin_to_nic_cpu(interface) if pin_cpu else None
+        transports = [t for t in await asyncio.gather(*(open_endpoint(port) for port in DISCOVERY_PORTS)) if t]
+        if not transports:
+            if previous_affinity is not None:
+                os.sched_setaffinity(0, previous_affinity)
+            raise OSError("no discovery port could be bound")
+        
+        logger.info(f"Listening for Tuya broadcasts on UDP ports "
+                    f"{', '.join(str(t.get_extra_info('sockname')[1]) for t in transports)} (up to {timeout:g}s)...")
+        
+        deadline = loop.time() + timeout
+        try:
+            while True:
+                now = loop.time()
+                stop_at = min(deadline, last_new + idle_timeout) if devices else deadline
+                if now >= stop_at:
+                    break
+                new_device.clear()
+                try:
+                    await asyncio.wait_for(new_device.wait(), stop_at - now)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for transport in transports:
+                transport.close()
+            if previous_affinity is not None:
+                os.sched_setaffinity(0, previous_affinity)
+        
+        return devices
+    
+    @staticmethod
+    def _decode_broadcast(data: bytes) -> Dict[str, Any]:
+        """Decode a device broadcast packet, returning {} if it is not one"""
+        try:
+            info = json.loads(tinytuya.decrypt_udp(data))
+        except Exception:
+            return {}
+        return info if isinstance(info, dict) else {}
+    
     def get_unconfigured_devices(self) -> List[Dict[str, Any]]:
         """Get devices that are discovered but not configured"""
-        config_devices = self.config_manager.config.get('devices', {})
-        unconfigured = []
+        configured_ids = self.config_manager.get_device_ids()
         
-        for device in self.discovered_devices:
-            device_id = device.get('gwId') or device.get('id')
-            if device_id and device_id not in config_devices:
-                unconfigured.append({
-                    'id': device_id,
-                    'ip': device.get('ip', 'Unknown'),
-                    'version': device.get('version', '3.3'),
-                    'product_id': device.get('product_id', ''),
-                    'encrypted': device.get('encrypted', False)
-                })
-        
-        return unconfigured
-    
-    def get_discovered_summary(self) -> List[Dict[str, str]]:
-        """Get summary of discovered devices for web UI"""
-        summary = []
-        config_devices = self.config_manager.config.get('devices', {})
+        return [
+            {
+                'id': device_id,
+                'ip': device.get('ip', 'Unknown'),
+                'version': device.get('version', '3.3'),
+                'product_id': device.get('product_id', ''),
+                'encrypted': device.get('encrypted', False)
+            }
+            for device in self.discovered_devices
+            for device_id in (device.get('gwId') or device.get('id'),)
+            if device_id and device_id not in configured_ids
+        ]
+    
+    def iter_discovered_summary(self) -> Iterator[Dict[str, Any]]:
+        """Iterate over the summary of discovered devices for web UI"""
+        configured_ids = self.config_manager.get_device_ids()
         
         for device in self.discovered_devices:
             device_id = device.get('gwId') or device.get('id')
-            is_configured = device_id in config_devices
+            is_configured = device_id in configured_ids
             
-            summary.append({
+            yield {
                 'id': device_id,
                 'ip': device.get('ip', 'Unknown'),
                 'version': device.get('version', '3.3'),
                 'product_id': device.get('product_id', ''),
                 'configured': is_configured,
                 'status': 'Configured' if is_configured else 'Not configured'
-            })
-        
-        return summary
\ No newline at end of file
+            }
+    
+    def get_discovered_summary(self) -> List[Dict[str, Any]]:
+        """Get summary of discovered devices for web UI"""
+        return list(self.iter_discovered_summary())
\ No newline at end of file
@@ -1,265 +1,360 @@
 """Enhanced Home Assistant MQTT Discovery for all platforms"""
 
+import hashlib
 import json
 import logging
 import re
+import threading
+from functools import lru_cache
+
+from jsonutil import dumps as _dumps
 
 logger = logging.getLogger(__name__)
 
+_INVALID_TOPIC_CHARS = re.compile(r'[^a-zA-Z0-9_-]')
+_REPEATED_UNDERSCORES = re.compile(r'_+')
+
 
 class HomeAssistantDiscovery:
     """Handles Home Assistant MQTT discovery for all supported platforms"""
     
+    # Home Assistant valid color mode combinations:
+    # - onoff (just on/off)
+    # - brightness (brightness only)
+    # - color_temp (color temp + brightness)
+    # - hs (hue/sat + brightness)
+    # - rgb (rgb + brightness)
+    # - rgbw (rgbw + brightness)
+    # - rgbww (rgbww + brightness)
+    # - white (white only + brightness)
+    #
+    # IMPORTANT: Cannot combine 'brightness' with 'hs' or 'color_temp'
+    # as those modes already include brightness control, so color wins over
+    # color temp, which wins over brightness.
+    #
+    # Indexed by (has_color << 2) | (has_color_temp << 1) | has_brightness
+    _COLOR_MODE_TABLE = (
+        ('onoff',), ('brightness',), ('color_temp',), ('color_temp',),
+        ('hs',), ('hs',), ('hs',), ('hs',)
+    )
+    
     def __init__(self, config_manager, mqtt_handler):
         self.config_manager = config_manager
         self.mqtt_handler = mqtt_handler
+        self._published_hashes = None
+        # Held while publishing, as HA coming online republishes from the MQTT loop
+        self._publish_lock = threading.Lock()
+        
+        # Builders of the platform-specific part of the discovery payload
+        self._platform_builders = {
+            'light': self._build_light,
+            'switch': self._build_switch,
+            'fan': self._build_fan,
+            'sensor': self._build_sensor,
+            'binary_sensor': self._build_binary_sensor,
+            'climate': self._build_climate,
+            'cover': self._build_cover,
+            'lock': self._build_lock,
+            'alarm_control_panel': self._build_alarm_control_panel,
+            'vacuum': self._build_vacuum,
+            'camera': self._build_camera,
+            'humidifier': self._build_humidifier,
+            'number': self._build_number,
+            'select': self._build_select,
+            'button': self._build_button
+        }
     
     @staticmethod
+    @lru_cache(maxsize=4096)
     def sanitize_topic(text: str) -> str:
         """
         Sanitize text for use in MQTT topics.
         Home Assistant requires topics to only contain: a-z A-Z 0-9 _ -
+        Results are cached, as the same IDs are sanitized on every republish.
         """
         # Replace spaces with underscores
         text = text.replace(' ', '_')
         # Remove any characters that aren't alphanumeric, underscore, or hyphen
-        text = re.sub(r'[^a-zA-Z0-9_-]', '', text)
+        text = _INVALID_TOPIC_CHARS.sub('', text)
         # Remove consecutive underscores
-        text = re.sub(r'_+', '_', text)
+        text = _REPEATED_UNDERSCORES.sub('_', text)
         # Remove leading/trailing underscores
         text = text.strip('_')
         return text
     
-    def publish_all_discoveries(self):
-        """Publish discovery for all entities"""
-        if not self.config_manager.config.get('homeassistant', {}).get('enabled', True):
+    def publish_all_discoveries(self, force: bool = False):
+        """Publish discovery for all entities
+        
+        Payloads the broker already holds from an earlier publish are skipped
+        unless `force` is set, which is done whenever Home Assistant comes
+        online as the broker may have lost its retained messages.
+        """
+        if not self.config_manager.homeassistant.enabled:
             return
         
-        discovery_prefix = self.config_manager.config['mqtt'].get('discovery_prefix', 'homeassistant')
+        mqtt_config = self.config_manager.mqtt
+        discovery_prefix = mqtt_config.discovery_prefix
+        base_topic = mqtt_config.base_topic
         
+        messages = []
         for device in self.mqtt_handler.device_manager.devices.values():
+            # Shared by every entity of the device
+            availability_topic = f"{base_topic}/{device.device_id}/availability"
+            device_block = {
+                'identifiers': [f"tuya2mqtt_{device.device_id}"],
+                'name': device.name,
+                'model': 'Tuya Device',
+                'manufacturer': 'Tuya',
+                'via_device': 'tuya2mqtt'
+            }
             for entity in device.entities:
-                self._publish_entity_discovery(device, entity, discovery_prefix)
+                messages.append(self._publish_entity_discovery(
+                    device, entity, discovery_prefix, base_topic, availability_topic, device_block))
         
-        logger.info("Published Home Assistant discovery for all entities")
+        with self._publish_lock:
+            if self._published_hashes is None:
+                self._published_hashes = self._load_published_hashes()
+            hashes = self._published_hashes
+            published = 0
+            
+            client = self.mqtt_handler.client
+            for discovery_topic, payload in messages:
+                digest = hashlib.blake2b(payload, digest_size=8).hexdigest()
+                if not force and hashes.get(discovery_topic) == digest:
+                    continue
+                # rc 0 is MQTT_ERR_SUCCESS, i.e. the message was queued
+                if client.publish(discovery_topic, payload, retain=True).rc == 0:
+                    hashes[discovery_topic] = digest
+                    published += 1
+                logger.debug(f"Published HA discovery: {discovery_topic}")
+            
+            if published:
+                self._save_published_hashes()
+        logger.info(f"Published Home Assistant discovery for all entities "
+                    f"({published} changed, {len(messages) - published} up to date)")
     
-    def _publish_entity_discovery(self, device, entity, discovery_prefix):
-        """Publish discovery for a single entity"""
-        base_topic = self.config_manager.config['mqtt']['base_topic']
+    def _discovery_cache_settings(self):
+        """Get the discovery cache file and the broker the cache applies to"""
+        mqtt_config = self.config_manager.mqtt
+        return self.config_manager.homeassistant.discovery_cache_file, f"{mqtt_config.host}:{mqtt_config.port}"
+    
+    def _load_published_hashes(self):
+        """Load the payload digests published to the configured broker"""
+        cache_file, broker = self._discovery_cache_settings()
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable HA discovery cache {cache_file}: {e}")
+            return {}
         
+        if cache.get('broker') != broker:
+            return {}
+        return cache.get('hashes', {})
+    
+    def _save_published_hashes(self):
+        """Persist the payload digests so restarts can skip unchanged payloads"""
+        cache_file, broker = self._discovery_cache_settings()
+        try:
+            with open(cache_file, 'w', encoding='utf-8') as f:
+                json.dump({'broker': broker, 'hashes': self._published_hashes}, f)
+        except Exception as e:
+            logger.warning(f"Failed to save HA discovery cache {cache_file}: {e}")
+    
+    def _publish_entity_discovery(self, device, entity, discovery_prefix, base_topic,
+                                  availability_topic, device_block):
+        """Build the (topic, payload) discovery message for a single entity"""
         # Sanitize entity_id for MQTT topic - remove spaces and special characters
         sanitized_entity_id = self.sanitize_topic(entity.entity_id)
-        sanitized_name = self.sanitize_topic(entity.name)
         
         # Create discovery topic with sanitized entity_id
         discovery_topic = f"{discovery_prefix}/{entity.platform}/{sanitized_entity_id}/config"
         
         # Use only device_id in topic (no entity name)
         entity_topic = f"{base_topic}/{device.device_id}/{sanitized_entity_id}"
+        state_topic = f"{entity_topic}/state"
+        set_topic = f"{entity_topic}/set"
+        command_topic = f"{entity_topic}/command"
         
         # Base discovery payload
         discovery_payload = {
             'name': entity.friendly_name,
             'unique_id': sanitized_entity_id,
-            'availability_topic': f"{base_topic}/{device.device_id}/availability",
+            'availability_topic': availability_topic,
             'icon': entity.icon,
-            'device': {
-                'identifiers': [f"tuya2mqtt_{device.device_id}"],
-                'name': device.name,
-                'model': 'Tuya Device',
-                'manufacturer': 'Tuya',
-                'via_device': 'tuya2mqtt'
-            }
+            'device': device_block
         }
         
         # Platform-specific configuration
-        if entity.platform == 'light':
-            color_modes = self._get_light_color_modes(entity)
-            
-            discovery_payload.update({
-                'state_topic': f"{entity_topic}/state",
-                'command_topic': f"{entity_topic}/set",
-                'schema': 'json'
-            })
-            
-            # Only add supported_color_modes if there are valid modes
-            if color_modes and len(color_modes) > 0:
-                discovery_payload['supported_color_modes'] = color_modes
-                
-                # Add brightness_scale only if brightness is supported
-                if 'brightness' in color_modes:
-                    discovery_payload['brightness_scale'] = 255
-        
-        elif entity.platform == 'switch':
-            discovery_payload.update({
-                'state_topic': f"{entity_topic}/state",
-                'command_topic': f"{entity_topic}/set",
-                'payload_on': 'ON',
-                'payload_off': 'OFF'
-            })
-        
-        elif entity.platform == 'fan':
-            discovery_payload.update({
-                'state_topic': f"{entity_topic}/state",
-                'command_topic': f"{entity_topic}/set",
-                'percentage_state_topic': f"{entity_topic}/speed",
-                'percentage_command_topic': f"{entity_topic}/set",
-                'payload_on': 'ON',
-                'payload_off': 'OFF'
-            })
-        
-        elif entity.platform == 'sensor':
-            discovery_payload.update({
-                'state_topic': f"{entity_topic}/state",
-            })
-            if entity.unit_of_measurement:
-                discovery_payload['unit_of_measurement'] = entity.unit_of_measurement
-            if entity.device_class:
-                discovery_payload['device_class'] = entity.device_class
-        
-        elif entity.platform == 'binary_sensor':
-            discovery_payload.update({
-                'state_topic': f"{entity_topic}/state",
-                'payload_on': True,
-                'payload_off': False
-            })
-            if entity.device_class:
-                discovery_payload['device_class'] = entity.device_class
-        
-        elif entity.platform == 'climate':
-            discovery_payload.update({
-                'mode_state_topic': f"{entity_topic}/state",
-                'mode_command_topic': f"{entity_topic}/set",
-                'temperature_state_topic': f"{entity_topic}/state",
-                'temperature_command_topic': f"{entity_topic}/set",
-                'current_temperature_topic': f"{entity_topic}/state",
-                'modes': entity.modes,
-                'min_temp': entity.temp_range[0],
-                'max_temp': entity.temp_range[1],
-                'temp_step': entity.temp_step,
-                'temperature_unit': entity.temperature_unit
-            })
-            if entity.fan_modes:
-                discovery_payload['fan_modes'] = entity.fan_modes
-                discovery_payload['fan_mode_state_topic'] = f"{entity_topic}/state"
-                discovery_payload['fan_mode_command_topic'] = f"{entity_topic}/set"
-        
-        elif entity.platform == 'cover':
-            discovery_payload.update({
-                'state_topic': f"{entity_topic}/state",
-                'command_topic': f"{entity_topic}/command",
-                'position_topic': f"{entity_topic}/position",
-                'set_position_topic': f"{entity_topic}/set",
-                'payload_open': 'OPEN',
-                'payload_close': 'CLOSE',
-                'payload_stop': 'STOP'
-            })
-        
-        elif entity.platform == 'lock':
-            discovery_payload.update({
-                'state_topic': f"{entity_topic}/state",
-                'command_topic': f"{entity_topic}/command",
-                'payload_lock': 'LOCK',
-                'payload_unlock': 'UNLOCK',
-                'state_locked': 'ON',
-                'state_unlocked': 'OFF'
-            })
-        
-        elif entity.platform == 'alarm_control_panel':
-            discovery_payload.update({
-                'state_topic': f"{entity_topic}/state",
-                'command_topic': f"{entity_topic}/command",
-                'code_arm_required': False
-            })
-        
-        elif entity.platform == 'vacuum':
-            discovery_payload.update({
-                'state_topic': f"{entity_topic}/state",
-                'command_topic': f"{entity_topic}/command",
-                'supported_features': ['start', 'stop', 'pause', 'return_home']
-            })
-        
-        elif entity.platform == 'camera':
-            discovery_payload.update({
-                'topic': f"{entity_topic}/image"
-            })
-            if entity.stream_url:
-                discovery_payload['stream_source'] = entity.stream_url
-        
-        elif entity.platform == 'humidifier':
-            discovery_payload.update({
-                'state_topic': f"{entity_topic}/state",
-                'command_topic': f"{entity_topic}/set",
-                'target_humidity_state_topic': f"{entity_topic}/target_humidity",
-                'target_humidity_command_topic': f"{entity_topic}/set",
-                'current_humidity_topic': f"{entity_topic}/humidity",
-                'min_humidity': entity.humidity_range[0],
-                'max_humidity': entity.humidity_range[1]
-            })
-            if entity.modes:
-                discovery_payload['modes'] = entity.modes
-        
-        elif entity.platform == 'number':
-            discovery_payload.update({
-                'state_topic': f"{entity_topic}/state",
-                'command_topic': f"{entity_topic}/set",
-                'min': entity.min_value,
-                'max': entity.max_value,
-                'step': entity.step
-            })
-            if entity.unit_of_measurement:
-                discovery_payload['unit_of_measurement'] = entity.unit_of_measurement
+        builder = self._platform_builders.get(entity.platform)
+        if builder:
+            discovery_payload.update(builder(entity, entity_topic, state_topic, set_topic, command_topic))
         
-        elif entity.platform == 'select':
-            discovery_payload.update({
-                'state_topic': f"{entity_topic}/state",
-                'command_topic': f"{entity_topic}/set",
-                'options': entity.options
-            })
-        
-        elif entity.platform == 'button':
-            discovery_payload.update({
-                'command_topic': f"{entity_topic}/command",
-                'payload_press': 'PRESS'
-            })
-        
-        # Publish discovery
-        self.mqtt_handler.client.publish(
-            discovery_topic,
-            json.dumps(discovery_payload),
-            retain=True
+        return discovery_topic, _dumps(discovery_payload)
+    
+    def _build_light(self, entity, entity_topic, state_topic, set_topic, command_topic):
+        color_modes = self._get_light_color_modes(
+            entity.get_dps('brightness') is not None,
+            entity.get_dps('color_temp') is not None,
+            entity.get_dps('color') is not None
         )
         
-        logger.debug(f"Published HA discovery: {discovery_topic}")
+        payload = {
+            'state_topic': state_topic,
+            'command_topic': set_topic,
+            'schema': 'json'
+        }
+        
+        # Only add supported_color_modes if there are valid modes
+        if color_modes and len(color_modes) > 0:
+            payload['supported_color_modes'] = color_modes
+            
+            # Add brightness_scale only if brightness is supported
+            if 'brightness' in color_modes:
+                payload['brightness_scale'] = 255
+        return payload
+    
+    def _build_switch(self, entity, entity_topic, state_topic, set_topic, command_topic):
+        return {
+            'state_topic': state_topic,
+            'command_topic': set_topic,
+            'payload_on': 'ON',
+            'payload_off': 'OFF'
+        }
+    
+    def _build_fan(self, entity, entity_topic, state_topic, set_topic, command_topic):
+        return {
+            'state_topic': state_topic,
+            'command_topic': set_topic,
+            'percentage_state_topic': f"{entity_topic}/speed",
+            'percentage_command_topic': set_topic,
+            'payload_on': 'ON',
+            'payload_off': 'OFF'
+        }
     
-    def _get_light_color_modes(self, entity):
+    def _build_sensor(self, entity, entity_topic, state_topic, set_topic, command_topic):
+        payload = {
+            'state_topic': state_topic,
+        }
+        if entity.unit_of_measurement:
+            payload['unit_of_measurement'] = entity.unit_of_measurement
+        if entity.device_class:
+            payload['device_class'] = entity.device_class
+        return payload
+    
+    def _build_binary_sensor(self, entity, entity_topic, state_topic, set_topic, command_topic):
+        payload = {
+            'state_topic': state_topic,
+            'payload_on': True,
+            'payload_off': False
+        }
+        if entity.device_class:
+            payload['device_class'] = entity.device_class
+        return payload
+    
+    def _build_climate(self, entity, entity_topic, state_topic, set_topic, command_topic):
+        payload = {
+            'mode_state_topic': state_topic,
+            'mode_command_topic': set_topic,
+            'temperature_state_topic': state_topic,
+            'temperature_command_topic': set_topic,
+            'current_temperature_topic': state_topic,
+            'modes': entity.modes,
+            'min_temp': entity.temp_range[0],
+            'max_temp': entity.temp_range[1],
+            'temp_step': entity.temp_step,
+            'temperature_unit': entity.temperature_unit
+        }
+        if entity.fan_modes:
+            payload['fan_modes'] = entity.fan_modes
+            payload['fan_mode_state_topic'] = state_topic
+            payload['fan_mode_command_topic'] = set_topic
+        return payload
+    
+    def _build_cover(self, entity, entity_topic, state_topic, set_topic, command_topic):
+        return {
+            'state_topic': state_topic,
+            'command_topic': command_topic,
+            'position_topic': f"{entity_topic}/position",
+            'set_position_topic': set_topic,
+            'payload_open': 'OPEN',
+            'payload_close': 'CLOSE',
+            'payload_stop': 'STOP'
+        }
+    
+    def _build_lock(self, entity, entity_topic, state_topic, set_topic, command_topic):
+        return {
+            'state_topic': state_topic,
+            'command_topic': command_topic,
+            'payload_lock': 'LOCK',
+            'payload_unlock': 'UNLOCK',
+            'state_locked': 'ON',
+            'state_unlocked': 'OFF'
+        }
+    
+    def _build_alarm_control_panel(self, entity, entity_topic, state_topic, set_topic, command_topic):
+        return {
+            'state_topic': state_topic,
+            'command_topic': command_topic,
+            'code_arm_required': False
+        }
+    
+    def _build_vacuum(self, entity, entity_topic, state_topic, set_topic, command_topic):
+        return {
+            'state_topic': state_topic,
+            'command_topic': command_topic,
+            'supported_features': ['start', 'stop', 'pause', 'return_home']
+        }
+    
+    def _build_camera(self, entity, entity_topic, state_topic, set_topic, command_topic):
+        payload = {
+            'topic': f"{entity_topic}/image"
+        }
+        if entity.stream_url:
+            payload['stream_source'] = entity.stream_url
+        return payload
+    
+    def _build_humidifier(self, entity, entity_topic, state_topic, set_topic, command_topic):
+        payload = {
+            'state_topic': state_topic,
+            'command_topic': set_topic,
+            'target_humidity_state_topic': f"{entity_topic}/target_humidity",
+            'target_humidity_command_topic': set_topic,
+            'current_humidity_topic': f"{entity_topic}/humidity",
+            'min_humidity': entity.humidity_range[0],
+            'max_humidity': entity.humidity_range[1]
+        }
+        if entity.modes:
+            payload['modes'] = entity.modes
+        return payload
+    
+    def _build_number(self, entity, entity_topic, state_topic, set_topic, command_topic):
+        payload = {
+            'state_topic': state_topic,
+            'command_topic': set_topic,
+            'min': entity.min_value,
+            'max': entity.max_value,
+            'step': entity.step
+        }
+        if entity.unit_of_measurement:
+            payload['unit_of_measurement'] = entity.unit_of_measurement
+        return payload
+    
+    def _build_select(self, entity, entity_topic, state_topic, set_topic, command_topic):
+        return {
+            'state_topic': state_topic,
+            'command_topic': set_topic,
+            'options': entity.options
+        }
+    
+    def _build_button(self, entity, entity_topic, state_topic, set_topic, command_topic):
+        return {
+            'command_topic': command_topic,
+            'payload_press': 'PRESS'
+        }
+    
+    def _get_light_color_modes(self, has_brightness: bool, has_color_temp: bool, has_color: bool):
         """Get supported color modes for light - only valid combinations"""
-        has_brightness = entity.get_dps('brightness') is not None
-        has_color_temp = entity.get_dps('color_temp') is not None
-        has_color = entity.get_dps('color') is not None
-        
-        # Home Assistant valid color mode combinations:
-        # - onoff (just on/off)
-        # - brightness (brightness only)
-        # - color_temp (color temp + brightness)
-        # - hs (hue/sat + brightness)
-        # - rgb (rgb + brightness)
-        # - rgbw (rgbw + brightness)
-        # - rgbww (rgbww + brightness)
-        # - white (white only + brightness)
-        
-        # IMPORTANT: Cannot combine 'brightness' with 'hs' or 'color_temp'
-        # as those modes already include brightness control
-        
-        if has_color:
-            # Color mode includes brightness automatically
-            return ['hs']
-        elif has_color_temp:
-            # Color temp mode includes brightness automatically
-            return ['color_temp']
-        elif has_brightness:
-            # Just brightness control
-            return ['brightness']
-        else:
-            # Just on/off
-            return ['onoff']
\ No newline at end of file
+        return list(self._COLOR_MODE_TABLE[(has_color << 2) | (has_color_temp << 1) | has_brightness])
\ No newline at end of file
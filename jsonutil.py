@@ -0,0 +1,31 @@
+"""Compact JSON encoding shared by all modules, using orjson when it is installed"""
+
+import json
+from datetime import date
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj: Any) -> str:
+    """Encode values JSON has no type for: dates as ISO 8601, anything else as str()"""
+    if isinstance(obj, date):
+        return obj.isoformat()
+    return str(obj)
+
+
+# Both encoders produce the same bytes (compact, UTF-8, non-string keys
+# coerced), so payloads and their digests don't depend on orjson being installed
+if orjson:
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    loads = orjson.loads
+else:
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, default=_default, separators=(',', ':'), ensure_ascii=False).encode()
+
+    loads = json.loads
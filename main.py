@@ -4,6 +4,7 @@ import logging
 import argparse
 import signal
 import sys
+import time
 from pathlib import Path
 
 from config import ConfigManager
@@ -30,6 +31,8 @@ class Tuya2MQTT:
         self.device_manager = DeviceManager(self.config_manager, self.database)
         self.mqtt_handler = MQTTHandler(self.config_manager, self.device_manager)
         self.ha_discovery = HomeAssistantDiscovery(self.config_manager, self.mqtt_handler)
+        # The broker may have lost the retained discovery payloads, send them all again
+        self.mqtt_handler.on_ha_online = lambda: self.ha_discovery.publish_all_discoveries(force=True)
         self.device_discovery = DeviceDiscovery(self.config_manager, self.device_manager)
         self.web_server = None
         self.running = False
@@ -39,9 +42,9 @@ class Tuya2MQTT:
         logger.info("Starting Tuya2MQTT Bridge v2.0")
         
         # Run auto-discovery if enabled
-        if self.config_manager.config.get('discovery', {}).get('enabled', False):
+        if self.config_manager.discovery.enabled:
             logger.info("Running automatic device discovery...")
-            self.device_discovery.scan_network()
+            self.device_discovery.scan_network_sync()
         
         # Initialize devices
         self.device_manager.initialize_devices()
@@ -50,30 +53,30 @@ class Tuya2MQTT:
         self.mqtt_handler.connect()
         
         # Publish Home Assistant discovery
-        if self.config_manager.config.get('homeassistant', {}).get('enabled', True):
+        if self.config_manager.homeassistant.enabled:
             self.ha_discovery.publish_all_discoveries()
         
         # Start device polling
         self.device_manager.start_polling(
             self.mqtt_handler.publish_device_state,
-            self.config_manager.config.get('poll_interval', 30)
+            self.config_manager.poll_interval
         )
         
         # Start web server if enabled
-        web_config = self.config_manager.config.get('web', {})
-        if web_config.get('enabled', True):
+        web_config = self.config_manager.web
+        if web_config.enabled:
             self.web_server = WebServer(
                 self.device_manager,
                 self.mqtt_handler,
                 self.database,
                 self.device_discovery,
-                web_config.get('port', 8099)
+                web_config.port
             )
             self.web_server.start()
         
         self.running = True
         logger.info("Tuya2MQTT Bridge started successfully")
-        logger.info(f"Web interface: http://0.0.0.0:{web_config.get('port', 8099)}")
+        logger.info(f"Web interface: http://0.0.0.0:{web_config.port}")
     
     def stop(self):
         """Stop all components"""
@@ -113,11 +116,15 @@ def main():
     
     app.start()
     
-    # Keep running
+    # Keep running, sleeping until a signal arrives
     try:
-        while app.running:
-            import time
-            time.sleep(1)
+        if hasattr(signal, 'pause'):
+            while app.running:
+                signal.pause()
+        else:
+            # No signal.pause() on Windows
+            while app.running:
+                time.sleep(1)
     except KeyboardInterrupt:
         app.stop()
 
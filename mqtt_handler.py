@@ -1,13 +1,42 @@
 """Enhanced MQTT communication handler with all platform support"""
 
-import json
 import logging
-import re
+import socket
+import threading
+import time
+from collections import deque
+from itertools import chain, islice
+from datetime import datetime
 from typing import Dict, Any
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+from device import ON_OFF_PLATFORMS
+from jsonutil import dumps as _dumps, loads as _loads
 
 logger = logging.getLogger(__name__)
 
+# Last topic level of messages carrying entity commands
+_COMMAND_SUFFIXES = ('set', 'command')
+
+# Command values that switch an entity on
+_TRUTHY_STATES = frozenset(('ON', 'on', True, 1, 'true', 'True'))
+
+# Switch DPS value for cover open/close commands
+_COVER_SWITCH_COMMANDS = {'open': True, 'close': False}
+
+# Repeats of a command within this many seconds, or values a device reported
+# this recently, are not sent to the device again
+COMMAND_DEDUP_WINDOW = 5.0
+
+# Seconds to give a device to apply a command before reading its state back
+REFRESH_DELAY = 0.5
+
+# State publishes waiting for the writer thread; the oldest are dropped
+# beyond this many, e.g. while the broker is unreachable
+PUBLISH_QUEUE_SIZE = 2000
+
 
 class MQTTHandler:
     """Handles MQTT communication for all platforms"""
@@ -16,68 +45,122 @@ class MQTTHandler:
         self.config_manager = config_manager
         self.device_manager = device_manager
         self.client = None
+        self._base_topic = None
+        self._base_prefix = None
+        self._ha_status_topic = None
+        # Called from the network loop when Home Assistant announces it is online
+        self.on_ha_online = None
+        # Last payload sent per topic, keyed by device ID
+        self._last_published = {}
         self.stats = {
             'messages_sent': 0,
             'messages_received': 0
         }
-    
-    @staticmethod
-    def sanitize_topic(text: str) -> str:
-        """
-        Sanitize text for use in MQTT topics.
-        Home Assistant requires topics to only contain: a-z A-Z 0-9 _ -
-        """
-        text = text.replace(' ', '_')
-        text = re.sub(r'[^a-zA-Z0-9_-]', '', text)
-        text = re.sub(r'_+', '_', text)
-        text = text.strip('_')
-        return text
+        
+        # MQTT 5 topic aliases for state topics, Properties keyed by topic
+        self._topic_aliases = {}
+        self._topic_alias_maximum = 0
+        self._alias_lock = threading.Lock()
+        
+        # DPS values recently sent per device ID, as {dps: (value, monotonic time)}
+        self._recent_commands = {}
+        
+        # Devices with a state refresh pending after a command
+        self._pending_refreshes = set()
+        self._refresh_lock = threading.Lock()
+        
+        # State publishes as (device_id, topic, payload, retain), sent by the writer thread
+        self._pub_queue = deque(maxlen=PUBLISH_QUEUE_SIZE)
+        self._pub_ready = threading.Condition()
+        self._writer_thread = None
+        
+        # Translators of entity commands into DPS changes, per platform
+        self._platform_handlers = {
+            'light': self._cmd_light_switch_fan,
+            'switch': self._cmd_light_switch_fan,
+            'fan': self._cmd_light_switch_fan,
+            'climate': self._cmd_climate,
+            'cover': self._cmd_cover,
+            'lock': self._cmd_lock,
+            'alarm_control_panel': self._cmd_alarm_control_panel,
+            'vacuum': self._cmd_vacuum,
+            'humidifier': self._cmd_humidifier,
+            'number': self._cmd_number,
+            'select': self._cmd_select
+        }
     
     def connect(self):
         """Connect to MQTT broker"""
-        mqtt_config = self.config_manager.config['mqtt']
+        mqtt_config = self.config_manager.mqtt
+        self._base_topic = mqtt_config.base_topic
+        self._base_prefix = f"{self._base_topic}/"
+        self._ha_status_topic = f"{mqtt_config.discovery_prefix}/status"
+        self.device_manager.assign_topics(self._base_topic)
         
-        self.client = mqtt.Client(client_id='tuya2mqtt')
+        # MQTT 5 lets repeated state topics be sent as 2-byte topic aliases
+        protocol = mqtt.MQTTv5 if str(mqtt_config.protocol) in ('5', '5.0') else mqtt.MQTTv311
+        self.client = mqtt.Client(client_id='tuya2mqtt', protocol=protocol)
         
-        if mqtt_config.get('username') and mqtt_config.get('password'):
+        if mqtt_config.username and mqtt_config.password:
             self.client.username_pw_set(
-                mqtt_config['username'],
-                mqtt_config['password']
+                mqtt_config.username,
+                mqtt_config.password
             )
         
         self.client.on_connect = self._on_connect
         self.client.on_message = self._on_message
         self.client.on_disconnect = self._on_disconnect
+        self.client.on_socket_open = self._on_socket_open
+        self.client.message_callback_add(self._ha_status_topic, self._on_ha_status)
         
-        base_topic = mqtt_config['base_topic']
-        self.client.will_set(f"{base_topic}/bridge/state", "offline", retain=True)
+        self.client.will_set(f"{self._base_topic}/bridge/state", "offline", retain=True)
         
         self.client.connect(
-            mqtt_config['host'],
-            mqtt_config.get('port', 1883),
+            mqtt_config.host,
+            mqtt_config.port,
             60
         )
         self.client.loop_start()
-        logger.info(f"Connected to MQTT broker at {mqtt_config['host']}")
+        
+        self._writer_thread = threading.Thread(target=self._drain_pub_queue, daemon=True)
+        self._writer_thread.start()
+        logger.info(f"Connected to MQTT broker at {mqtt_config.host}")
     
     def disconnect(self):
         """Disconnect from MQTT broker"""
+        if self._writer_thread:
+            # Flush queued state before announcing the bridge offline
+            self._enqueue_publishes([None])
+            self._writer_thread.join(timeout=5)
+            self._writer_thread = None
+        
         if self.client:
-            base_topic = self.config_manager.config['mqtt']['base_topic']
-            self.client.publish(f"{base_topic}/bridge/state", "offline", retain=True)
+            self.client.publish(f"{self._base_topic}/bridge/state", "offline", retain=True)
             self.client.loop_stop()
             self.client.disconnect()
     
-    def _on_connect(self, client, userdata, flags, rc):
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
         """MQTT connect callback"""
         if rc == 0:
             logger.info("Connected to MQTT broker")
-            base_topic = self.config_manager.config['mqtt']['base_topic']
+            base_topic = self._base_topic
+            
+            # Aliases only live as long as the connection
+            with self._alias_lock:
+                self._topic_aliases = {}
+                self._topic_alias_maximum = getattr(properties, 'TopicAliasMaximum', 0)
             
-            # Subscribe to command topics
-            client.subscribe(f"{base_topic}/+/+/set")
-            client.subscribe(f"{base_topic}/+/+/command")
-            client.subscribe(f"{base_topic}/+/set")
+            # The broker may have restarted, send full state again on next poll
+            self._last_published.clear()
+            
+            # Subscribe to command topics and Home Assistant birth messages
+            # (to resend state after HA restarts) in a single request
+            client.subscribe([
+                (f"{base_topic}/+/+/set", 0),
+                (f"{base_topic}/+/+/command", 0),
+                (f"{base_topic}/+/set", 0),
+                (self._ha_status_topic, 0)
+            ])
             
             # Publish online status
             client.publish(f"{base_topic}/bridge/state", "online", retain=True)
@@ -88,224 +171,330 @@ class MQTTHandler:
                 'version': '2.0',
                 'name': 'Tuya2MQTT Bridge'
             }
-            client.publish(f"{base_topic}/bridge/info", json.dumps(bridge_info), retain=True)
+            client.publish(f"{base_topic}/bridge/info", _dumps(bridge_info), retain=True)
+    
+    def _on_socket_open(self, client, userdata, sock):
+        """MQTT socket open callback"""
+        # State updates are small and sent in bursts, don't hold them back for Nagle
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError) as e:
+            logger.debug(f"Cannot set TCP_NODELAY on MQTT socket: {e}")
     
-    def _on_disconnect(self, client, userdata, rc):
+    def _on_disconnect(self, client, userdata, rc, properties=None):
         """MQTT disconnect callback"""
         if rc != 0:
             logger.warning(f"Unexpected MQTT disconnect: {rc}")
     
+    def _on_ha_status(self, client, userdata, msg):
+        """Home Assistant status callback"""
+        if msg.payload == b'online':
+            logger.info("Home Assistant came online, resending full state on next poll")
+            self._last_published.clear()
+            if self.on_ha_online:
+                # Exceptions must not reach the paho loop
+                try:
+                    self.on_ha_online()
+                except Exception as e:
+                    logger.error(f"Error handling Home Assistant birth message: {e}")
+    
     def _on_message(self, client, userdata, msg):
         """MQTT message callback"""
-        try:
-            self.stats['messages_received'] += 1
-            base_topic = self.config_manager.config['mqtt']['base_topic']
-            topic = msg.topic.replace(f"{base_topic}/", "")
-            parts = topic.split('/')
-            
-            if len(parts) < 2:
-                return
-            
-            device_id = parts[0]
-            device = self.device_manager.get_device(device_id)
-            
-            if not device:
-                logger.warning(f"Unknown device: {device_id}")
-                return
-            
-            payload = msg.payload.decode()
-            
-            # Handle entity commands
-            if len(parts) >= 3 and parts[2] in ['set', 'command']:
-                entity_name = parts[1]
-                entity = device.get_entity_by_id(f"{device_id}_{entity_name}")
-                
-                if entity:
-                    self._handle_entity_command(device, entity, payload)
+        self.stats['messages_received'] += 1
+        topic = msg.topic
+        prefix = self._base_prefix
+        if not topic.startswith(prefix):
+            return
+        parts = topic[len(prefix):].split('/', 3)
         
-        except Exception as e:
-            logger.error(f"Error handling MQTT message: {e}")
+        if len(parts) < 2:
+            return
+        
+        device_id = parts[0]
+        device = self.device_manager.get_device(device_id)
+        
+        if not device:
+            logger.warning(f"Unknown device: {device_id}")
+            return
+        
+        # Handle entity commands
+        if len(parts) >= 3 and parts[2] in _COMMAND_SUFFIXES:
+            entity_name = parts[1]
+            entity = device.get_entity_by_name(entity_name)
+            
+            if entity:
+                # Exceptions must not escape into the paho network loop
+                try:
+                    self._handle_entity_command(device, entity, msg.payload.decode())
+                except Exception as e:
+                    logger.error(f"Error handling MQTT message: {e}")
     
     def _handle_entity_command(self, device, entity, payload):
         """Handle entity-specific command for all platforms"""
         try:
-            data = json.loads(payload) if payload.startswith('{') else {'command': payload}
-            dps_changes = {}
-            
-            # Light, Switch, Fan
-            if entity.platform in ['light', 'switch', 'fan']:
-                if 'state' in data:
-                    switch_dps = entity.get_dps('switch')
-                    if switch_dps:
-                        dps_changes[switch_dps] = data['state'] in ['ON', True, 1, 'true']
-                
-                if 'brightness' in data and entity.platform in ['light', 'fan']:
-                    brightness_dps = entity.get_dps('brightness' if entity.platform == 'light' else 'speed')
-                    if brightness_dps:
-                        min_val, max_val = entity.brightness_range if entity.platform == 'light' else entity.speed_range
-                        scaled = int(min_val + (data['brightness'] / 255) * (max_val - min_val))
-                        dps_changes[brightness_dps] = scaled
-                
-                if 'color_temp' in data and entity.platform == 'light':
-                    color_temp_dps = entity.get_dps('color_temp')
-                    if color_temp_dps:
-                        min_val, max_val = entity.color_temp_range
-                        scaled = int(min_val + (data['color_temp'] / 500) * (max_val - min_val))
-                        dps_changes[color_temp_dps] = scaled
-            
-            # Climate
-            elif entity.platform == 'climate':
-                if 'mode' in data:
-                    mode_dps = entity.get_dps('mode')
-                    if mode_dps:
-                        dps_changes[mode_dps] = data['mode']
-                
-                if 'target_temp' in data or 'temperature' in data:
-                    temp_dps = entity.get_dps('target_temp')
-                    temp = data.get('target_temp', data.get('temperature'))
-                    if temp_dps and temp:
-                        dps_changes[temp_dps] = int(temp / entity.temp_step)
-                
-                if 'fan_mode' in data:
-                    fan_dps = entity.get_dps('fan_mode')
-                    if fan_dps:
-                        dps_changes[fan_dps] = data['fan_mode']
-            
-            # Cover
-            elif entity.platform == 'cover':
-                if 'command' in data:
-                    cmd = data['command'].lower()
-                    switch_dps = entity.get_dps('switch')
-                    if cmd == 'open':
-                        dps_changes[switch_dps] = True
-                    elif cmd == 'close':
-                        dps_changes[switch_dps] = False
-                    elif cmd == 'stop':
-                        dps_changes[entity.get_dps('direction')] = 'stop'
-                
-                if 'position' in data:
-                    pos_dps = entity.get_dps('position')
-                    if pos_dps:
-                        dps_changes[pos_dps] = int(data['position'])
-            
-            # Lock
-            elif entity.platform == 'lock':
-                if 'command' in data or 'state' in data:
-                    lock_dps = entity.get_dps('lock')
-                    cmd = data.get('command', data.get('state', '')).lower()
-                    if lock_dps:
-                        dps_changes[lock_dps] = cmd == 'lock'
-            
-            # Alarm
-            elif entity.platform == 'alarm_control_panel':
-                if 'command' in data:
-                    state_dps = entity.get_dps('state')
-                    cmd = data['command'].lower()
-                    state_map = {v: k for k, v in entity.states.items()}
-                    if state_dps and cmd in state_map:
-                        dps_changes[state_dps] = state_map[cmd]
-            
-            # Vacuum
-            elif entity.platform == 'vacuum':
-                if 'command' in data:
-                    cmd = data['command'].lower()
-                    power_dps = entity.get_dps('power')
-                    mode_dps = entity.get_dps('mode')
-                    
-                    if cmd == 'start':
-                        dps_changes[power_dps] = True
-                    elif cmd == 'stop' or cmd == 'pause':
-                        dps_changes[power_dps] = False
-                    elif cmd == 'return_to_base':
-                        dps_changes[mode_dps] = 'return'
-                
-                if 'mode' in data:
-                    mode_dps = entity.get_dps('mode')
-                    if mode_dps:
-                        dps_changes[mode_dps] = data['mode']
-            
-            # Humidifier
-            elif entity.platform == 'humidifier':
-                if 'state' in data:
-                    switch_dps = entity.get_dps('switch')
-                    if switch_dps:
-                        dps_changes[switch_dps] = data['state'] in ['ON', True]
-                
-                if 'mode' in data:
-                    mode_dps = entity.get_dps('mode')
-                    if mode_dps:
-                        dps_changes[mode_dps] = data['mode']
-                
-                if 'target_humidity' in data:
-                    humidity_dps = entity.get_dps('target_humidity')
-                    if humidity_dps:
-                        dps_changes[humidity_dps] = int(data['target_humidity'])
-            
-            # Number
-            elif entity.platform == 'number':
-                if 'value' in data:
-                    value_dps = entity.get_dps('value')
-                    if value_dps:
-                        dps_changes[value_dps] = data['value']
+            data = _loads(payload) if payload.startswith('{') else {'command': payload}
+        except ValueError as e:
+            logger.error(f"Invalid command payload for {entity.entity_id}: {e}")
+            return
+        
+        dps_changes = {}
+        handler = self._platform_handlers.get(entity.platform)
+        if handler:
+            handler(entity, data, dps_changes)
+        
+        self._drop_unchanged_dps(device, dps_changes)
+        
+        # Apply changes
+        if dps_changes:
+            # Only values the device accepted count as sent, so a failed
+            # command is not dropped when it is retried
+            if device.set_multiple_dps(dps_changes):
+                self.remember_sent_dps(device, dps_changes)
             
-            # Select
-            elif entity.platform == 'select':
-                if 'option' in data:
-                    option_dps = entity.get_dps('option')
-                    if option_dps:
-                        dps_changes[option_dps] = data['option']
+            # Update state without blocking the MQTT network thread
+            self.schedule_refresh(device)
+    
+    def _drop_unchanged_dps(self, device, dps_changes):
+        """Remove DPS changes the device already has or was just sent"""
+        now = time.monotonic()
+        recent = self._recent_commands.get(device.device_id, {})
+        state = device.last_state
+        state_is_fresh = (
+            device.last_update is not None and
+            (datetime.now() - device.last_update).total_seconds() < COMMAND_DEDUP_WINDOW
+        )
+        
+        for dps, value in list(dps_changes.items()):
+            observed = state.get(dps, state.get(str(dps)))
+            sent = recent.get(dps)
+            if sent is not None and sent[0] == value and now - sent[1] < COMMAND_DEDUP_WINDOW:
+                # Unless a poll since then saw the value changed on the device
+                # (e.g. at the wall switch), it still has what was sent
+                polled_since = device.last_update is not None and device.last_update > sent[2]
+                if not (polled_since and observed != value):
+                    del dps_changes[dps]
+                    continue
+            if state_is_fresh and observed == value:
+                del dps_changes[dps]
+        
+        if not dps_changes:
+            logger.debug(f"Ignoring command for {device.device_id}, nothing changes")
+    
+    def remember_sent_dps(self, device, dps_changes):
+        """Record DPS values sent to a device, from MQTT or elsewhere, for _drop_unchanged_dps"""
+        sent = (time.monotonic(), datetime.now())
+        recent = self._recent_commands.setdefault(device.device_id, {})
+        for dps, value in dps_changes.items():
+            recent[dps] = (value, *sent)
+    
+    def _cmd_light_switch_fan(self, entity, data, dps_changes):
+        """Translate a light, switch or fan command into DPS changes"""
+        dps_map = entity.dps_map
+        
+        if 'state' in data:
+            switch_dps = dps_map.get('switch')
+            if switch_dps:
+                dps_changes[switch_dps] = data['state'] in _TRUTHY_STATES
+        
+        if 'brightness' in data and entity.platform in ('light', 'fan'):
+            brightness_dps = dps_map.get('brightness' if entity.platform == 'light' else 'speed')
+            if brightness_dps:
+                min_val, max_val = entity.brightness_range if entity.platform == 'light' else entity.speed_range
+                scaled = int(min_val + (data['brightness'] / 255) * (max_val - min_val))
+                dps_changes[brightness_dps] = scaled
+        
+        if 'color_temp' in data and entity.platform == 'light':
+            color_temp_dps = dps_map.get('color_temp')
+            if color_temp_dps:
+                min_val, max_val = entity.color_temp_range
+                scaled = int(min_val + (data['color_temp'] / 500) * (max_val - min_val))
+                dps_changes[color_temp_dps] = scaled
+    
+    def _cmd_climate(self, entity, data, dps_changes):
+        """Translate a climate command into DPS changes"""
+        dps_map = entity.dps_map
+        
+        if 'mode' in data:
+            mode_dps = dps_map.get('mode')
+            if mode_dps:
+                dps_changes[mode_dps] = data['mode']
+        
+        if 'target_temp' in data or 'temperature' in data:
+            temp_dps = dps_map.get('target_temp')
+            temp = data.get('target_temp', data.get('temperature'))
+            if temp_dps and temp:
+                dps_changes[temp_dps] = int(temp / entity.temp_step)
+        
+        if 'fan_mode' in data:
+            fan_dps = dps_map.get('fan_mode')
+            if fan_dps:
+                dps_changes[fan_dps] = data['fan_mode']
+    
+    def _cmd_cover(self, entity, data, dps_changes):
+        """Translate a cover command into DPS changes"""
+        dps_map = entity.dps_map
+        
+        if 'command' in data:
+            cmd = data['command'].lower()
+            if cmd in _COVER_SWITCH_COMMANDS:
+                dps_changes[dps_map.get('switch')] = _COVER_SWITCH_COMMANDS[cmd]
+            elif cmd == 'stop':
+                dps_changes[dps_map.get('direction')] = 'stop'
+        
+        if 'position' in data:
+            pos_dps = dps_map.get('position')
+            if pos_dps:
+                dps_changes[pos_dps] = int(data['position'])
+    
+    def _cmd_lock(self, entity, data, dps_changes):
+        """Translate a lock command into DPS changes"""
+        if 'command' in data or 'state' in data:
+            lock_dps = entity.dps_map.get('lock')
+            cmd = data.get('command', data.get('state', '')).lower()
+            if lock_dps:
+                dps_changes[lock_dps] = cmd == 'lock'
+    
+    def _cmd_alarm_control_panel(self, entity, data, dps_changes):
+        """Translate an alarm control panel command into DPS changes"""
+        if 'command' in data:
+            state_dps = entity.dps_map.get('state')
+            cmd = data['command'].lower()
+            state_map = {v: k for k, v in entity.states.items()}
+            if state_dps and cmd in state_map:
+                dps_changes[state_dps] = state_map[cmd]
+    
+    def _cmd_vacuum(self, entity, data, dps_changes):
+        """Translate a vacuum command into DPS changes"""
+        dps_map = entity.dps_map
+        
+        if 'command' in data:
+            cmd = data['command'].lower()
             
-            # Apply changes
-            if dps_changes:
-                if len(dps_changes) == 1:
-                    dps, value = list(dps_changes.items())[0]
-                    device.set_dps(dps, value)
-                else:
-                    device.set_multiple_dps(dps_changes)
-                
-                # Update state
-                import time
-                time.sleep(0.5)
-                device.get_status()
-                self.publish_device_state(device)
+            if cmd == 'start':
+                dps_changes[dps_map.get('power')] = True
+            elif cmd == 'stop' or cmd == 'pause':
+                dps_changes[dps_map.get('power')] = False
+            elif cmd == 'return_to_base':
+                dps_changes[dps_map.get('mode')] = 'return'
         
+        if 'mode' in data:
+            mode_dps = dps_map.get('mode')
+            if mode_dps:
+                dps_changes[mode_dps] = data['mode']
+    
+    def _cmd_humidifier(self, entity, data, dps_changes):
+        """Translate a humidifier command into DPS changes"""
+        dps_map = entity.dps_map
+        
+        if 'state' in data:
+            switch_dps = dps_map.get('switch')
+            if switch_dps:
+                dps_changes[switch_dps] = data['state'] in _TRUTHY_STATES
+        
+        if 'mode' in data:
+            mode_dps = dps_map.get('mode')
+            if mode_dps:
+                dps_changes[mode_dps] = data['mode']
+        
+        if 'target_humidity' in data:
+            humidity_dps = dps_map.get('target_humidity')
+            if humidity_dps:
+                dps_changes[humidity_dps] = int(data['target_humidity'])
+    
+    def _cmd_number(self, entity, data, dps_changes):
+        """Translate a number command into DPS changes"""
+        if 'value' in data:
+            value_dps = entity.dps_map.get('value')
+            if value_dps:
+                dps_changes[value_dps] = data['value']
+    
+    def _cmd_select(self, entity, data, dps_changes):
+        """Translate a select command into DPS changes"""
+        if 'option' in data:
+            option_dps = entity.dps_map.get('option')
+            if option_dps:
+                dps_changes[option_dps] = data['option']
+    
+    def schedule_refresh(self, device):
+        """Refresh and publish device state shortly, unless already scheduled"""
+        with self._refresh_lock:
+            if device.device_id in self._pending_refreshes:
+                return
+            self._pending_refreshes.add(device.device_id)
+        self.device_manager.call_later(REFRESH_DELAY, self._refresh_device, device)
+    
+    def _refresh_device(self, device):
+        """Read back device state after a command and publish it"""
+        # Commands arriving from now on need a refresh of their own
+        with self._refresh_lock:
+            self._pending_refreshes.discard(device.device_id)
+        try:
+            device.get_status()
+            self.publish_device_state(device)
         except Exception as e:
-            logger.error(f"Error handling entity command: {e}")
+            logger.error(f"Failed to refresh {device.device_id} after command: {e}")
+    
+    def _publish_fast(self, topic: str, payload):
+        """Publish a state update as QoS 0 and not retained
+        
+        On MQTT 5 connections the topic is replaced by a topic alias once the
+        broker has seen it, within the alias limit the broker allows.
+        """
+        if not self._topic_alias_maximum:
+            return self.client.publish(topic, payload, 0, False)
+        
+        # Held while publishing so the message defining an alias is always
+        # queued before the ones using it
+        with self._alias_lock:
+            alias = self._topic_aliases.get(topic)
+            if alias is not None:
+                return self.client.publish('', payload, 0, False, alias)
+            if len(self._topic_aliases) < self._topic_alias_maximum:
+                alias = Properties(PacketTypes.PUBLISH)
+                alias.TopicAlias = len(self._topic_aliases) + 1
+                self._topic_aliases[topic] = alias
+                return self.client.publish(topic, payload, 0, False, alias)
+        return self.client.publish(topic, payload, 0, False)
     
     def publish_device_state(self, device):
-        """Publish device state to MQTT"""
-        base_topic = self.config_manager.config['mqtt']['base_topic']
+        """Publish device state to MQTT
         
-        # Publish availability
+        Only topics whose payload changed since the last publish are sent.
+        Reconnects and Home Assistant restarts clear the record, so everything
+        is sent on the next poll.
+        """
+        last_published = self._last_published.setdefault(device.device_id, {})
+        
+        # Publish availability, retained so Home Assistant sees it on startup
         availability = "online" if device.available else "offline"
-        self.client.publish(
-            f"{base_topic}/{device.device_id}/availability",
-            availability,
-            retain=True
-        )
+        topic = device.availability_topic
+        if last_published.get(topic) != availability:
+            self._enqueue_publishes([(device.device_id, topic, availability, True)])
+            last_published[topic] = availability
         
         if not device.available:
             return
         
+        # Collect everything first so the publishes go out back to back
+        messages = []
+        
         # Publish entity states
         for entity in device.entities:
-            # Use sanitized entity_id for topic (device_id + entity_name)
-            sanitized_entity_id = self.sanitize_topic(entity.entity_id)
-            entity_topic = f"{base_topic}/{device.device_id}/{sanitized_entity_id}"
+            state_topic = entity.mqtt_state_topic
             
             # Platform-specific state publishing
-            if entity.platform in ['light', 'switch', 'fan', 'lock']:
+            if entity.platform in ON_OFF_PLATFORMS:
                 state = "ON" if entity.state.get('switch', False) or entity.state.get('lock', False) else "OFF"
-                self.client.publish(f"{entity_topic}/state", state)
+                messages.append((state_topic, state))
                 
                 # Additional attributes
                 for key, value in entity.state.items():
                     if key != 'switch' and key != 'lock':
-                        self.client.publish(f"{entity_topic}/{key}", json.dumps(value))
+                        messages.append((f"{entity.mqtt_topic_prefix}/{key}", _dumps(value)))
             
-            elif entity.platform in ['sensor', 'binary_sensor']:
+            elif entity.platform in ('sensor', 'binary_sensor'):
                 value = entity.get_state_value()
-                self.client.publish(f"{entity_topic}/state", json.dumps(value))
+                messages.append((state_topic, _dumps(value)))
             
             elif entity.platform == 'climate':
                 state_data = {
@@ -314,27 +503,78 @@ class MQTTHandler:
                     'mode': entity.state.get('mode', 'off'),
                     'fan_mode': entity.state.get('fan_mode', 'auto')
                 }
-                self.client.publish(f"{entity_topic}/state", json.dumps(state_data))
+                messages.append((state_topic, _dumps(state_data)))
             
             elif entity.platform == 'alarm_control_panel':
                 alarm_state = entity.state.get('state', 'disarmed')
-                self.client.publish(f"{entity_topic}/state", alarm_state)
+                messages.append((state_topic, alarm_state))
             
             elif entity.platform == 'vacuum':
                 vacuum_state = {
                     'state': 'cleaning' if entity.state.get('power') else 'docked',
                     'battery_level': entity.state.get('battery', 100)
                 }
-                self.client.publish(f"{entity_topic}/state", json.dumps(vacuum_state))
+                messages.append((state_topic, _dumps(vacuum_state)))
             
             else:
                 # Generic state publishing
-                self.client.publish(f"{entity_topic}/state", json.dumps(entity.state))
+                messages.append((state_topic, _dumps(entity.state)))
         
         # Publish raw DPS state
-        self.client.publish(
-            f"{base_topic}/{device.device_id}/state",
-            json.dumps(device.last_state)
-        )
+        messages.append((device.raw_state_topic, _dumps(device.last_state)))
+        
+        pending = []
+        for topic, payload in messages:
+            if last_published.get(topic) == payload:
+                continue
+            pending.append((device.device_id, topic, payload, False))
+            last_published[topic] = payload
         
-        self.stats['messages_sent'] += len(device.entities) + 2
\ No newline at end of file
+        if pending:
+            self._enqueue_publishes(pending)
+    
+    def _enqueue_publishes(self, items):
+        """Queue publishes for the writer thread, dropping the oldest when full"""
+        with self._pub_ready:
+            dropped = len(self._pub_queue) + len(items) - PUBLISH_QUEUE_SIZE
+            if dropped > 0:
+                logger.warning(f"Publish queue full, dropping {dropped} oldest messages")
+                # Forget them as published, so the next poll sends them again
+                for item in islice(chain(self._pub_queue, items), dropped):
+                    if item:
+                        self._forget_published(item[0], item[1])
+            self._pub_queue.extend(items)
+            self._pub_ready.notify()
+    
+    def _drain_pub_queue(self):
+        """Writer thread: send queued publishes so polling never waits on the broker"""
+        queue = self._pub_queue
+        while True:
+            with self._pub_ready:
+                while not queue:
+                    self._pub_ready.wait()
+                item = queue.popleft()
+            
+            if item is None:
+                return
+            
+            device_id, topic, payload, retain = item
+            try:
+                if retain:
+                    result = self.client.publish(topic, payload, 0, True)
+                else:
+                    result = self._publish_fast(topic, payload)
+                # rc 0 is MQTT_ERR_SUCCESS; anything else was never sent
+                if result.rc == 0:
+                    self.stats['messages_sent'] += 1
+                else:
+                    self._forget_published(device_id, topic)
+            except Exception as e:
+                logger.error(f"Failed to publish to {topic}: {e}")
+                self._forget_published(device_id, topic)
+    
+    def _forget_published(self, device_id, topic):
+        """Drop the last published payload of a topic whose publish was lost"""
+        last_published = self._last_published.get(device_id)
+        if last_published is not None:
+            last_published.pop(topic, None)
@@ -0,0 +1,613 @@
+let devicesData = {};
+let eventSource = null;
+// Whether the event stream is connected; devices are polled while it is not
+let streamOpen = false;
+// Slider whose thumb is being dragged, and the latest move not yet drawn
+let dragCtx = null;
+let pendingMove = null;
+// Device cards by device ID, as { card, status, entities: Map(entity ID -> { node, html }) }.
+// Cards of devices that dropped out of the list are kept for when they return.
+const cardNodes = new Map();
+let renderedDeviceIds = null;
+// Pending refresh after a control change, and the device fetch in flight
+let refreshTimer = null;
+let devicesAbort = null;
+// ETag of the device list last rendered from a snapshot, so an unchanged one isn't resent
+let devicesETag = null;
+// Interval of the periodic refresh, stopped while the tab is hidden
+let pollId = null;
+// Wakes waitForScan() when the stream announces a finished scan
+let scanDone = null;
+
+function showTab(tab) {
+    for (const t of document.getElementsByClassName('tab')) t.classList.remove('active');
+    for (const c of document.getElementsByClassName('tab-content')) c.classList.remove('active');
+    event.target.classList.add('active');
+    document.getElementById(tab + '-tab').classList.add('active');
+
+    if (tab === 'unconfigured') loadUnconfiguredDevices();
+    if (tab === 'entities') loadEntitiesList();
+}
+
+async function loadUnconfiguredDevices() {
+    try {
+        const res = await fetch('/api/devices/unconfigured');
+        const devices = await res.json();
+
+        const container = document.getElementById('unconfigured-devices');
+
+        if (devices.length === 0) {
+            container.innerHTML = `
+                <div class="device-card empty-card">
+                    <h2>✅ Vše nakonfigurováno!</h2>
+                    <p>Žádná nenakonfigurovaná zařízení nebyla nalezena.</p>
+                    <p>Klikněte na "🔍 Skenovat zařízení" pro vyhledání nových.</p>
+                </div>
+            `;
+            return;
+        }
+
+        container.innerHTML = devices.map(device => `
+            <div class="device-card new-device-card">
+                <div class="device-header">
+                    <div class="device-name">Nenakonfigurované zařízení</div>
+                    <div class="device-status status-new">Nové</div>
+                </div>
+                <div class="new-device-info">
+                    <div><strong>ID:</strong> ${device.id}</div>
+                    <div><strong>IP:</strong> ${device.ip}</div>
+                    <div><strong>Verze:</strong> ${device.version}</div>
+                    ${device.product_id ? `<div><strong>Product ID:</strong> ${device.product_id}</div>` : ''}
+                </div>
+                <div class="info-box howto">
+                    <strong>📝 Jak přidat:</strong>
+                    <ol>
+                        <li>Získejte local_key: <code>python -m tinytuya wizard</code></li>
+                        <li>Přidejte do <code>config.yaml</code></li>
+                        <li>Restartujte bridge</li>
+                    </ol>
+                </div>
+                <button class="btn btn-primary btn-block" 
+                        onclick="copyDeviceTemplate('${device.id}', '${device.ip}', '${device.version}')">
+                    📋 Kopírovat šablonu konfigurace
+                </button>
+            </div>
+        `).join('');
+    } catch (e) {
+        console.error('Chyba:', e);
+        document.getElementById('unconfigured-devices').innerHTML = 
+            '<div class="loading">❌ Chyba při načítání</div>';
+    }
+}
+
+function copyDeviceTemplate(deviceId, ip, version) {
+    const template = `  ${deviceId}:
+    name: "Nové zařízení"
+    ip: "${ip}"
+    local_key: "ZÍSKEJTE_POMOCÍ_TINYTUYA_WIZARD"
+    version: "${version}"
+    entities:
+      - platform: switch
+        name: "main_switch"
+        friendly_name: "Hlavní vypínač"
+        dps:
+          switch: 1
+        icon: "mdi:power"`;
+
+    navigator.clipboard.writeText(template).then(() => {
+        alert('✅ Šablona zkopírována do schránky!\n\nVložte ji do config.yaml pod sekci "devices:"');
+    }).catch(() => {
+        alert('❌ Nepodařilo se zkopírovat. Zkopírujte ručně:\n\n' + template);
+    });
+}
+
+async function loadStats() {
+    try {
+        const res = await fetch('/api/stats');
+        renderStats(await res.json());
+    } catch (e) {
+        console.error('Chyba:', e);
+    }
+}
+
+function renderStats(stats) {
+    let html = `
+        <div class="stat-card">
+            <div class="stat-value">${stats.uptime}</div>
+            <div class="stat-label">⏱️ Uptime</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-value">${stats.devices_online}/${stats.devices_total}</div>
+            <div class="stat-label">📱 Online zařízení</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-value">${stats.entities_total}</div>
+            <div class="stat-label">⚙️ Entity</div>
+        </div>
+        <div class="stat-card">
+            <div class="stat-value">${stats.mqtt_sent + stats.mqtt_received}</div>
+            <div class="stat-label">📨 MQTT zprávy</div>
+        </div>
+    `;
+
+    if (stats.history_records !== undefined) {
+        html += `
+            <div class="stat-card">
+                <div class="stat-value">${stats.history_records}</div>
+                <div class="stat-label">💾 DB záznamy</div>
+            </div>
+        `;
+    }
+
+    document.getElementById('stats').innerHTML = html;
+}
+
+function newDevicesFetch() {
+    // A newer fetch of the devices supersedes the one still in flight
+    if (devicesAbort) devicesAbort.abort();
+    return devicesAbort = new AbortController();
+}
+
+function setDevices(devices) {
+    devicesData = {};
+    devices.forEach(d => devicesData[d.device_id] = d);
+    renderDevices();
+}
+
+function showDevicesError(e) {
+    console.error('Chyba:', e);
+    renderedDeviceIds = null;
+    devicesETag = null;
+    document.getElementById('devices').innerHTML = '<div class="loading">❌ Chyba při načítání</div>';
+}
+
+async function loadDevices() {
+    const abort = newDevicesFetch();
+    try {
+        const res = await fetch('/api/devices', { signal: abort.signal });
+        setDevices(await res.json());
+    } catch (e) {
+        if (e.name !== 'AbortError') showDevicesError(e);
+    }
+}
+
+async function loadSnapshot() {
+    // Stats and devices in one request; the devices are left out while unchanged
+    const abort = newDevicesFetch();
+    try {
+        const headers = devicesETag ? { 'If-None-Match': `"${devicesETag}"` } : {};
+        const res = await fetch('/api/snapshot', { signal: abort.signal, headers });
+        const snapshot = await res.json();
+        renderStats(snapshot.stats);
+        if (snapshot.devices) {
+            devicesETag = snapshot.devices_etag;
+            setDevices(snapshot.devices);
+        }
+    } catch (e) {
+        if (e.name !== 'AbortError') showDevicesError(e);
+    }
+}
+
+function htmlToElement(html) {
+    const template = document.createElement('template');
+    template.innerHTML = html.trim();
+    return template.content.firstElementChild;
+}
+
+function renderDevices() {
+    // Cards are built once, later renders only replace the entities whose markup changed
+    const container = document.getElementById('devices');
+    const devices = Object.values(devicesData);
+    const deviceIds = devices.map(d => d.device_id).join('\n');
+
+    if (deviceIds !== renderedDeviceIds) {
+        // Reuse the cards we have, so a changed list only builds the new devices
+        container.replaceChildren(...devices.map(device => {
+            if (!cardNodes.has(device.device_id)) return buildDeviceCard(device);
+            patchDeviceCard(device);
+            return cardNodes.get(device.device_id).card;
+        }));
+        renderedDeviceIds = deviceIds;
+        return;
+    }
+    devices.forEach(patchDeviceCard);
+}
+
+function buildDeviceCard(device) {
+    const card = htmlToElement(createDeviceCard(device));
+    const entitiesEl = card.getElementsByClassName('entities')[0];
+    const entities = new Map();
+    device.entities.forEach(entity => {
+        const html = createEntityControl(device, entity);
+        const node = htmlToElement(html);
+        entitiesEl.appendChild(node);
+        entities.set(entity.entity_id, { node, html });
+    });
+    cardNodes.set(device.device_id, { card, status: card.getElementsByClassName('device-status')[0], entities });
+    return card;
+}
+
+function patchDeviceCard(device) {
+    const refs = cardNodes.get(device.device_id);
+    if (refs.entities.size !== device.entities.length || device.entities.some(e => !refs.entities.has(e.entity_id))) {
+        refs.card.replaceWith(buildDeviceCard(device));
+        return;
+    }
+
+    const statusClass = `device-status ${device.available ? 'status-online' : 'status-offline'}`;
+    if (refs.status.className !== statusClass) {
+        refs.status.className = statusClass;
+        refs.status.textContent = device.available ? 'Online' : 'Offline';
+    }
+
+    device.entities.forEach(entity => {
+        const ref = refs.entities.get(entity.entity_id);
+        const html = createEntityControl(device, entity);
+        if (html === ref.html) return;
+        const node = htmlToElement(html);
+        ref.node.replaceWith(node);
+        ref.node = node;
+        ref.html = html;
+    });
+}
+
+function connectStream() {
+    // The server pushes each device again whenever its state changes, and all of
+    // them on every (re)connect. EventSource reconnects by itself after errors,
+    // but not once the server refused the stream (503); devices are polled then.
+    if (!window.EventSource) return;
+    eventSource = new EventSource('/api/stream');
+    eventSource.onopen = () => { streamOpen = true; };
+    eventSource.onerror = () => { streamOpen = false; };
+    eventSource.onmessage = (e) => {
+        const device = JSON.parse(e.data);
+        devicesData[device.device_id] = device;
+        // Each message carries one device, so only its card needs patching
+        const refs = cardNodes.get(device.device_id);
+        if (refs && refs.card.isConnected) patchDeviceCard(device);
+        else renderDevices();
+    };
+    eventSource.addEventListener('scan_complete', () => { if (scanDone) scanDone(); });
+}
+
+function createDeviceCard(device) {
+    const statusClass = device.available ? 'status-online' : 'status-offline';
+    const statusText = device.available ? 'Online' : 'Offline';
+
+    return `
+        <div class="device-card">
+            <div class="device-header">
+                <div class="device-name">${device.name}</div>
+                <div class="device-status ${statusClass}">${statusText}</div>
+            </div>
+            <div class="entities"></div>
+        </div>
+    `;
+}
+
+function createEntityControl(device, entity) {
+    const platform = entity.platform;
+    let controls = '';
+
+    if (['light', 'switch', 'fan', 'lock'].includes(platform)) {
+        const isOn = entity.state.switch || entity.state.lock || false;
+        controls += `
+            <div class="control-row">
+                <span class="control-label">Stav:</span>
+                <div class="toggle ${isOn ? 'active' : ''}" 
+                     data-action="toggle"
+                     data-entity="${entity.entity_id}" 
+                     data-control="switch"></div>
+            </div>
+        `;
+
+        if (platform === 'light' && entity.state.brightness !== undefined) {
+            const brightness = Math.round((entity.state.brightness / 1000) * 100);
+            controls += createSlider(entity.entity_id, 'brightness', brightness, 'Jas');
+        } else if (platform === 'fan' && entity.state.speed !== undefined) {
+            controls += createSlider(entity.entity_id, 'brightness', entity.state.speed * 33, 'Rychlost');
+        }
+    } else if (platform === 'climate') {
+        const temp = entity.state.target_temp || 20;
+        controls += `
+            <div class="control-row">
+                <span class="control-label">Teplota:</span>
+                <div class="control-value">${temp}°C</div>
+            </div>
+        `;
+    } else if (platform === 'sensor') {
+        const value = entity.state.value || 0;
+        const unit = entity.unit_of_measurement || '';
+        controls += `
+            <div class="control-row">
+                <span class="control-label">Hodnota:</span>
+                <div class="control-value">${value} ${unit}</div>
+            </div>
+        `;
+    }
+
+    const dps = Object.entries(entity.state).map(([k,v]) => `${k}: ${JSON.stringify(v)}`).join(', ');
+
+    // Show unmapped DPS if available
+    let unmappedHtml = '';
+    if (device.unmapped_dps && Object.keys(device.unmapped_dps).length > 0) {
+        const unmappedEntries = Object.entries(device.unmapped_dps)
+            .map(([dps, val]) => `DPS ${dps}: ${JSON.stringify(val)}`)
+            .join(', ');
+        unmappedHtml = `
+            <div class="unmapped-dps">
+                <strong>⚠️ Nepřiřazené DPS:</strong> ${unmappedEntries}
+            </div>
+        `;
+    }
+
+    return `
+        <div class="entity platform-${platform}">
+            <div class="entity-header">
+                <div class="entity-name">${entity.friendly_name}</div>
+                <div class="entity-platform">${platform}</div>
+            </div>
+            <div class="entity-controls">${controls}</div>
+            <div class="dps-info">DPS: ${dps}</div>
+            ${unmappedHtml}
+        </div>
+    `;
+}
+
+function createSlider(entityId, control, value, label) {
+    return `
+        <div class="control-row">
+            <span class="control-label">${label}:</span>
+            <div class="slider-container" data-action="slider" data-entity="${entityId}" data-control="${control}" style="--pct: ${value / 100}">
+                <div class="slider-fill"></div>
+                <div class="slider-track"><div class="slider-thumb" data-action="drag"></div></div>
+            </div>
+            <div class="control-value" id="value-${entityId}">${Math.round(value)}%</div>
+        </div>
+    `;
+}
+
+function sliderContext(slider) {
+    // Value label looked up once, and the slider's box measured on first use
+    return {
+        slider,
+        rect: null,
+        valueEl: document.getElementById(`value-${slider.dataset.entity}`)
+    };
+}
+
+function updateSlider(ctx, e) {
+    const rect = ctx.rect || (ctx.rect = ctx.slider.getBoundingClientRect());
+    const x = Math.max(0, Math.min(e.clientX - rect.left, rect.width));
+    const percent = Math.round((x / rect.width) * 100);
+
+    // Fill and thumb follow through transforms, which need no layout
+    ctx.slider.style.setProperty('--pct', percent / 100);
+    ctx.valueEl.textContent = percent + '%';
+    return percent;
+}
+
+function setSlider(ctx, e) {
+    const percent = updateSlider(ctx, e);
+    controlEntity(ctx.slider.dataset.entity, { [ctx.slider.dataset.control]: percent });
+}
+
+// Click handlers by the data-action of the clicked control; a thumb is dragged, not clicked
+const clickActions = {
+    toggle: (el) => controlEntity(el.dataset.entity, { state: !el.classList.contains('active') }),
+    slider: (el, e) => setSlider(sliderContext(el), e)
+};
+
+function initDeviceEvents() {
+    // Delegated once to the container, so re-rendered cards need no rebinding
+    const container = document.getElementById('devices');
+
+    container.addEventListener('click', (e) => {
+        const el = e.target.closest('[data-action]');
+        const action = el && clickActions[el.dataset.action];
+        if (action) action(el, e);
+    });
+
+    // The grabbed thumb captures the pointer, so its moves and release are
+    // delivered to it (and bubble here) wherever the pointer goes
+    container.addEventListener('pointerdown', (e) => {
+        if (e.target.dataset.action !== 'drag') return;
+        e.target.setPointerCapture(e.pointerId);
+        dragCtx = sliderContext(e.target.closest('.slider-container'));
+        dragCtx.pointerId = e.pointerId;
+    });
+
+    // The measured box is only valid until the page scrolls or resizes
+    const forgetRect = () => { if (dragCtx) dragCtx.rect = null; };
+    window.addEventListener('scroll', forgetRect, { passive: true });
+    window.addEventListener('resize', forgetRect, { passive: true });
+
+    container.addEventListener('pointermove', (e) => {
+        if (!dragCtx || e.pointerId !== dragCtx.pointerId) return;
+        // Draw at most once per frame, however often the pointer reports
+        if (!pendingMove) requestAnimationFrame(drawPendingMove);
+        pendingMove = e;
+    }, { passive: true });
+
+    container.addEventListener('pointerup', (e) => {
+        if (!dragCtx || e.pointerId !== dragCtx.pointerId) return;
+        const ctx = dragCtx;
+        dragCtx = null;
+        pendingMove = null;
+        if (ctx.slider.isConnected) setSlider(ctx, e);
+    });
+
+    container.addEventListener('pointercancel', (e) => {
+        if (dragCtx && e.pointerId === dragCtx.pointerId) dragCtx = null;
+    });
+}
+
+function drawPendingMove() {
+    const e = pendingMove;
+    pendingMove = null;
+    // The card may have been re-rendered while dragging
+    if (e && dragCtx && dragCtx.slider.isConnected) updateSlider(dragCtx, e);
+}
+
+async function controlEntity(entityId, data) {
+    const parts = entityId.split('_');
+    const deviceId = parts[0];
+    const entityName = parts.slice(1).join('_');
+
+    try {
+        const res = await fetch(`/api/device/${deviceId}/entity/${entityName}/set`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(data)
+        });
+
+        if (res.ok && !streamOpen) scheduleRefresh();
+    } catch (e) {
+        console.error('Chyba:', e);
+    }
+}
+
+async function loadEntitiesList() {
+    const entities = document.getElementById('entities-list');
+    entities.innerHTML = '<div class="loading">Načítám všechny entity...</div>';
+
+    try {
+        const res = await fetch('/api/devices');
+        const devices = await res.json();
+
+        let allEntities = [];
+        devices.forEach(device => {
+            device.entities.forEach(entity => {
+                allEntities.push({
+                    device: device,
+                    entity: entity
+                });
+            });
+        });
+
+        if (allEntities.length === 0) {
+            entities.innerHTML = '<div class="loading">Žádné entity nenalezeny</div>';
+            return;
+        }
+
+        // Filled in with textContent, so names can't inject markup
+        const tpl = document.getElementById('entity-tpl').content.firstElementChild;
+        const frag = document.createDocumentFragment();
+        for (const item of allEntities) {
+            const node = tpl.cloneNode(true);
+            const field = name => node.getElementsByClassName(name)[0];
+            field('entity-name').textContent = item.entity.friendly_name;
+            field('entity-device').textContent = `${item.device.name} (${item.entity.entity_id})`;
+            field('entity-platform').textContent = item.entity.platform;
+            field('entity-state').textContent = JSON.stringify(item.entity.state);
+            field('entity-dps').textContent = JSON.stringify(item.entity.dps_map);
+            if (item.entity.icon) field('entity-icon').textContent = item.entity.icon;
+            else field('entity-icon-row').remove();
+            frag.appendChild(node);
+        }
+        entities.replaceChildren(frag);
+    } catch (e) {
+        console.error('Chyba:', e);
+        entities.innerHTML = '<div class="loading">❌ Chyba při načítání</div>';
+    }
+}
+
+async function loadDatabaseStats() {
+    // Removed - no longer needed
+}
+
+async function waitForScan(job) {
+    // The scan runs in the background. The event stream announces when it is
+    // done; without the stream, poll it every second.
+    while (job.task_id && (job.status === 'started' || job.status === 'running')) {
+        await new Promise(resolve => {
+            scanDone = resolve;
+            setTimeout(resolve, streamOpen ? 10000 : 1000);
+        });
+        scanDone = null;
+        const res = await fetch(`/api/discovery/scan/${job.task_id}`);
+        job = await res.json();
+    }
+    return job;
+}
+
+async function scanDevices() {
+    if (!confirm('Spustit sken sítě pro Tuya zařízení? Trvá 20-30 sekund.')) return;
+
+    const btn = event.target;
+    const originalText = btn.innerHTML;
+    btn.innerHTML = '⏳ Skenování...';
+    btn.disabled = true;
+
+    try {
+        const res = await fetch('/api/discovery/scan', { method: 'POST' });
+        const data = await waitForScan(await res.json());
+
+        if (data.success) {
+            const unconfigured = data.devices.filter(d => !d.configured);
+            let message = `✅ Nalezeno ${data.discovered} zařízení!\n\n`;
+
+            if (unconfigured.length > 0) {
+                message += `⚠️ Nenakonfigurovaná zařízení: ${unconfigured.length}\n`;
+                message += 'Zobrazují se v sekci "Nenakonfigurovaná zařízení"\n\n';
+                unconfigured.forEach(d => {
+                    message += `• ${d.id.substring(0, 16)}...\n`;
+                    message += `  IP: ${d.ip}\n`;
+                });
+            } else {
+                message += 'Všechna nalezená zařízení jsou již nakonfigurovaná.';
+            }
+
+            alert(message);
+            loadDevices();
+            loadUnconfiguredDevices();
+        } else {
+            alert('❌ Chyba při skenování: ' + (data.error || data.message));
+        }
+    } catch (e) {
+        alert('❌ Chyba při skenování: ' + e.message);
+    } finally {
+        btn.innerHTML = originalText;
+        btn.disabled = false;
+    }
+}
+
+function scheduleRefresh() {
+    // Changes made in quick succession share one reload
+    if (refreshTimer) return;
+    refreshTimer = setTimeout(() => { refreshTimer = null; loadDevices(); }, 500);
+}
+
+function refreshAll() {
+    loadSnapshot();
+}
+
+function poll() {
+    if (streamOpen) loadStats();
+    else loadSnapshot();
+}
+
+function startPolling() {
+    if (!pollId) pollId = setInterval(poll, 5000);
+}
+
+function stopPolling() {
+    clearInterval(pollId);
+    pollId = null;
+}
+
+document.addEventListener('visibilitychange', () => {
+    if (document.hidden) {
+        stopPolling();
+    } else {
+        poll();
+        startPolling();
+    }
+});
+
+// Inicializace
+initDeviceEvents();
+loadSnapshot();
+loadUnconfiguredDevices();
+connectStream();
+startPolling();
@@ -0,0 +1,77 @@
+"""Tests for the adaptive poll schedule"""
+
+import unittest
+
+from config import AdaptivePollingConfig
+from device import AdaptivePollSchedule
+
+
+def _schedule_with(intervals, interval=30, min_interval=5, max_interval=300):
+    """Build a schedule that has seen state changes the given seconds apart"""
+    schedule = AdaptivePollSchedule(interval, min_interval, max_interval)
+    now = 0.0
+    schedule.record(now, True)
+    for gap in intervals:
+        now += gap
+        schedule.record(now, True)
+    return schedule, now
+
+
+class AdaptivePollScheduleTest(unittest.TestCase):
+    
+    def test_fixed_interval_until_enough_samples(self):
+        schedule, now = _schedule_with([60] * (AdaptivePollSchedule.MIN_SAMPLES - 1))
+        self.assertEqual(schedule.next_delay(now), 30)
+    
+    def test_unchanged_polls_are_not_samples(self):
+        schedule, now = _schedule_with([60] * (AdaptivePollSchedule.MIN_SAMPLES - 1))
+        schedule.record(now + 10, False)
+        self.assertEqual(schedule.next_delay(now + 10), 30)
+    
+    def test_fit_offsets_are_increasing_and_bounded(self):
+        schedule, _ = _schedule_with([20 + (i * 7) % 80 for i in range(50)])
+        offsets = schedule._fit()
+        self.assertEqual(offsets[0], schedule.min_interval)
+        self.assertLessEqual(len(offsets), AdaptivePollSchedule.MAX_OFFSETS)
+        for previous, current in zip(offsets, offsets[1:]):
+            self.assertGreaterEqual(round(current - previous, 9), schedule.min_interval)
+            self.assertLessEqual(round(current - previous, 9), schedule.max_interval)
+    
+    def test_polls_are_dense_around_the_usual_change_time(self):
+        schedule, _ = _schedule_with([58, 59, 60, 61, 62] * 8)
+        offsets = schedule._fit()
+        near = [o for o in offsets if 50 <= o <= 70]
+        before = [o for o in offsets if 10 <= o <= 30]
+        self.assertGreater(len(near), len(before))
+    
+    def test_next_delay_stays_within_limits(self):
+        schedule, now = _schedule_with([20 + (i * 7) % 80 for i in range(50)])
+        for since_change in range(0, 400, 3):
+            delay = schedule.next_delay(now + since_change)
+            self.assertGreaterEqual(delay, schedule.min_interval)
+            self.assertLessEqual(delay, schedule.max_interval)
+    
+    def test_next_delay_after_last_offset_is_max_interval(self):
+        schedule, now = _schedule_with([60] * 30)
+        self.assertEqual(schedule.next_delay(now + 10000), schedule.max_interval)
+    
+    def test_identical_samples(self):
+        schedule, now = _schedule_with([60] * 30, min_interval=0.5)
+        delay = schedule.next_delay(now + 1)
+        self.assertGreaterEqual(delay, 0.5)
+        self.assertLessEqual(delay, 300)
+
+
+class AdaptivePollingConfigTest(unittest.TestCase):
+    
+    def test_rejects_non_positive_min_interval(self):
+        with self.assertRaises(ValueError):
+            AdaptivePollingConfig(min_interval=0)
+    
+    def test_rejects_max_below_min(self):
+        with self.assertRaises(ValueError):
+            AdaptivePollingConfig(min_interval=10, max_interval=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,17 +3,116 @@
 # ============================================================================
 """Enhanced Flask web server with improved UI"""
 
-import json
+import copy
+import gzip
+import hashlib
 import logging
 import time
-from datetime import datetime
 from pathlib import Path
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context, url_for
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from jsonutil import dumps as _dumps, orjson
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
 
 logger = logging.getLogger(__name__)
 
+# Seconds repeated GETs of hot API endpoints are answered from memory
+RESPONSE_CACHE_TTL = 1.0
+HISTORY_CACHE_TTL = 10.0
+
+# Cached responses kept at most; expired ones are pruned first, then the oldest
+RESPONSE_CACHE_SIZE = 256
+
+# Most history records one request may ask for
+HISTORY_MAX_LIMIT = 1000
+
+# Responses at least this many bytes are gzipped for clients that accept it
+COMPRESS_MIN_SIZE = 500
+COMPRESS_LEVEL = 4
+COMPRESS_MIMETYPES = frozenset(('application/json', 'text/html', 'text/css', 'text/javascript'))
+
+# Static assets are linked with a content hash, so browsers may keep them
+STATIC_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# The page itself is revalidated after a while, answered with 304 unless it changed
+INDEX_CACHE_CONTROL = 'public, max-age=300, must-revalidate'
+INDEX_COMPRESS_LEVEL = 9
+
+# Seconds to collect control changes for a device before sending them together
+CONTROL_COALESCE_DELAY = 0.05
+
+# Worker threads of the waitress server; every open event stream holds one
+WEB_THREADS = 16
+WEB_CONNECTION_LIMIT = 200
+WEB_CHANNEL_TIMEOUT = 30
+
+# Event streams open at once; more are refused with 503 and those clients poll
+# instead, so streams can't take every worker thread from the API and the page
+MAX_EVENT_STREAMS = WEB_THREADS // 2
+
+# Seconds between comments sent on an idle event stream, so closed
+# connections are noticed
+STREAM_KEEPALIVE = 15.0
+
+
+if orjson:
+    class _OrjsonProvider(DefaultJSONProvider):
+        """Flask JSON provider encoding with orjson instead of the stdlib json"""
+        
+        # datetime, date and dataclasses are serialized natively by orjson
+        # (datetime as ISO 8601); other types fall back to Flask's default
+        option = orjson.OPT_NON_STR_KEYS
+        
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj, default=self.default, option=self.option).decode()
+        
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+        
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            return self._app.response_class(
+                orjson.dumps(obj, default=self.default, option=self.option),
+                mimetype=self.mimetype
+            )
+
+
+def _json_array_stream(items):
+    """Yield a JSON array chunk by chunk, one item at a time"""
+    yield b'['
+    for i, item in enumerate(items):
+        yield (b',' if i else b'') + _dumps(item)
+    yield b']'
+
+
+def _scale_level(entity, value):
+    """Scale a 0-100 level into the brightness or speed range of an entity"""
+    min_val, max_val = entity.brightness_range if entity.platform == 'light' else entity.speed_range
+    return int(min_val + (value / 100) * (max_val - min_val))
+
+
+# Web UI control keys as {key: (DPS codes tried in order, value transform,
+# key that takes precedence when both are sent)}
+_CONTROLS = {
+    'state': (('switch', 'power', 'lock'), lambda entity, value: value, None),
+    'brightness': (('brightness', 'speed'), _scale_level, None),
+    'level': (('brightness', 'speed'), _scale_level, 'brightness'),
+    'temperature': (('target_temp',), lambda entity, value: int(value / entity.temp_step), None),
+    'target_temp': (('target_temp',), lambda entity, value: int(value / entity.temp_step), 'temperature'),
+    'mode': (('mode',), lambda entity, value: value, None),
+    'position': (('position',), lambda entity, value: int(value), None),
+    'target_humidity': (('target_humidity',), lambda entity, value: int(value), None)
+}
+
 
 class WebServer:
     """Enhanced Flask web server"""
@@ -24,25 +123,94 @@ class WebServer:
         self.database = database
         self.discovery = discovery
         self.port = port
-        self.app = Flask(__name__)
+        self.app = Flask(__name__, template_folder=str(Path(__file__).parent / 'templates'))
+        if orjson:
+            self.app.json = _OrjsonProvider(self.app)
+        # Skip the key sort and the debug-mode pretty printing
+        self.app.json.sort_keys = False
+        self.app.json.compact = True
         CORS(self.app)
         self.server_thread = None
-        self.start_time = datetime.now()
+        self._start_mono = time.monotonic()
+        
+        # Encoded JSON bodies as {key: (monotonic expiry, body)}
+        self._response_cache = {}
+        self._response_cache_lock = threading.Lock()
+        # Encoded device JSON as {device_id: (state_version, body)}
+        self._device_json_cache = {}
+        # Encoded device list as (state versions, ETag, body)
+        self._devices_json_cache = None
+        
+        # Control changes not yet sent, as {device_id: {dps: value}}
+        self._pending_dps = {}
+        self._pending_lock = threading.Lock()
+        
+        # Encoded config with secrets masked, and the config it was built from
+        self._safe_config_json = None
+        self._safe_config_source = None
+        
+        # Network scans run in the background, one at a time
+        self._scan_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='web-scan')
+        self._scan_lock = threading.Lock()
+        self._scan_id = None
+        self._scan_future = None
+        # Last finished scan, announced on the event streams
+        self._scan_done_id = None
+        
+        # Content hashes of static assets, by file name
+        self._asset_versions = {}
+        self.app.add_template_global(self._asset_url, 'asset_url')
+        # Rendered index page as (ETag, body, gzipped body)
+        self._index_page = None
+        
+        # Bumped on every device status update, waking the event streams
+        self._state_seq = 0
+        self._state_changed = threading.Condition()
+        self._stream_slots = threading.BoundedSemaphore(MAX_EVENT_STREAMS)
+        self.device_manager.add_state_listener(self._on_device_status)
         
         self._setup_routes()
-        self._create_templates()
     
     def _setup_routes(self):
         """Setup Flask routes"""
         
+        self.app.after_request(self._cache_static)
+        self.app.after_request(self._compress_response)
+        
         @self.app.route('/')
         def index():
-            return render_template('index.html')
+            etag, body, body_gz = self._get_index_page()
+            if 'gzip' in request.headers.get('Accept-Encoding', ''):
+                response = Response(body_gz, mimetype='text/html')
+                response.headers['Content-Encoding'] = 'gzip'
+                etag += '-gz'
+            else:
+                response = Response(body, mimetype='text/html')
+            response.vary.add('Accept-Encoding')
+            response.headers['Cache-Control'] = INDEX_CACHE_CONTROL
+            response.set_etag(etag)
+            return response.make_conditional(request)
         
         @self.app.route('/api/devices')
         def get_devices():
-            devices = [d.to_dict() for d in self.device_manager.devices.values()]
-            return jsonify(devices)
+            etag, body = self._devices_json()
+            response = Response(body, mimetype='application/json')
+            # Weak, as the body may still be gzipped on the way out. Browsers keep
+            # the list and revalidate it with If-None-Match on every poll.
+            response.set_etag(etag, weak=True)
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+        
+        @self.app.route('/api/stream')
+        def stream():
+            """Server-sent events with the state of each device as it changes"""
+            if not self._stream_slots.acquire(blocking=False):
+                return jsonify({'error': 'Too many event streams'}), 503
+            response = Response(self._device_events(), mimetype='text/event-stream',
+                                headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+            # The server closes the response when the client goes away
+            response.call_on_close(self._stream_slots.release)
+            return response
         
         @self.app.route('/api/devices/unconfigured')
         def get_unconfigured_devices():
@@ -55,7 +223,7 @@ class WebServer:
             device = self.device_manager.get_device(device_id)
             if not device:
                 return jsonify({'error': 'Device not found'}), 404
-            return jsonify(device.to_dict())
+            return Response(self._device_json(device), mimetype='application/json')
         
         @self.app.route('/api/device/<device_id>/entity/<entity_name>/set', methods=['POST'])
         def set_entity(device_id, entity_name):
@@ -63,7 +231,7 @@ class WebServer:
             if not device:
                 return jsonify({'error': 'Device not found'}), 404
             
-            entity = device.get_entity_by_id(f"{device_id}_{entity_name}")
+            entity = device.get_entity_by_name(entity_name)
             if not entity:
                 return jsonify({'error': 'Entity not found'}), 404
             
@@ -71,9 +239,8 @@ class WebServer:
             success = self._handle_entity_control(device, entity, data)
             
             if success:
-                time.sleep(0.5)
-                device.get_status()
-                return jsonify({'success': True, 'entity': entity.to_dict()})
+                # Sent shortly by the coalescing flush, which also schedules the state refresh
+                return jsonify({'success': True}), 202
             
             return jsonify({'success': False}), 400
         
@@ -82,858 +249,331 @@ class WebServer:
             if not self.database:
                 return jsonify({'error': 'Database not enabled'}), 400
             
-            limit = request.args.get('limit', 100, type=int)
-            history = self.database.get_entity_history(entity_id, limit)
-            return jsonify(history)
+            # Bounded, as it is part of the cache key and -1 means no limit to SQLite
+            limit = min(max(request.args.get('limit', 100, type=int), 1), HISTORY_MAX_LIMIT)
+            return self._cached_json(('history', entity_id, limit), HISTORY_CACHE_TTL,
+                                     lambda: list(self.database.get_entity_history(entity_id, limit)))
         
         @self.app.route('/api/stats')
         def get_stats():
-            uptime = datetime.now() - self.start_time
-            stats = {
-                'uptime': str(uptime).split('.')[0],
-                'devices_total': len(self.device_manager.devices),
-                'devices_online': sum(1 for d in self.device_manager.devices.values() if d.available),
-                'entities_total': len(self.device_manager.get_all_entities()),
-                'mqtt_sent': self.mqtt_handler.stats['messages_sent'],
-                'mqtt_received': self.mqtt_handler.stats['messages_received']
-            }
-            
-            if self.database:
-                db_stats = self.database.get_statistics()
-                stats.update(db_stats)
-            
-            return jsonify(stats)
+            return self._cached_json('stats', RESPONSE_CACHE_TTL, self._build_stats)
+        
+        @self.app.route('/api/snapshot')
+        def get_snapshot():
+            stats = self._cached_bytes('stats', RESPONSE_CACHE_TTL, self._build_stats)
+            devices_etag, devices = self._devices_json()
+            # Stats include the uptime and change on every poll, so only the
+            # device list is conditional on the client's If-None-Match
+            if request.if_none_match.contains_weak(devices_etag):
+                devices = b'null'
+            response = Response(b'{"stats":' + stats + b',"devices_etag":"' + devices_etag.encode()
+                                + b'","devices":' + devices + b'}', mimetype='application/json')
+            response.cache_control.no_store = True
+            return response
         
         @self.app.route('/api/discovery/scan', methods=['POST'])
         def scan_devices():
-            try:
+            with self._scan_lock:
+                if self._scan_future and not self._scan_future.done():
+                    return jsonify({
+                        'success': False,
+                        'task_id': self._scan_id,
+                        'status': 'running',
+                        'message': 'Scan already in progress.'
+                    }), 409
+                
                 logger.info("Starting device scan from web interface...")
-                devices = self.discovery.scan_network()
-                summary = self.discovery.get_discovered_summary()
+                force = request.args.get('force', 'false').lower() in ('1', 'true')
+                task_id = self._scan_id = uuid.uuid4().hex
+                self._scan_future = self._scan_executor.submit(self._run_scan, force)
+                self._scan_future.add_done_callback(lambda f: self._on_scan_done(task_id))
                 
-                return jsonify({
-                    'success': True,
-                    'discovered': len(devices),
-                    'devices': summary,
-                    'message': f'Found {len(devices)} devices. Check logs for details.'
-                })
-            except Exception as e:
-                logger.error(f"Scan failed: {e}", exc_info=True)
-                return jsonify({
-                    'success': False,
-                    'error': str(e),
-                    'message': 'Scan failed. Check logs for details.'
-                }), 500
+                return jsonify({'success': True, 'task_id': self._scan_id, 'status': 'started'}), 202
+        
+        @self.app.route('/api/discovery/scan/<task_id>')
+        def get_scan(task_id):
+            with self._scan_lock:
+                if task_id != self._scan_id:
+                    return jsonify({'error': 'Scan not found'}), 404
+                future = self._scan_future
+            
+            if not future.done():
+                return jsonify({'task_id': task_id, 'status': 'running'})
+            
+            result = future.result()
+            if not result['success']:
+                return jsonify({'task_id': task_id, 'status': 'failed', **result}), 500
+            return jsonify({'task_id': task_id, 'status': 'done', **result})
         
         @self.app.route('/api/discovery/devices')
         def get_discovered_devices():
             """Get list of discovered devices"""
-            summary = self.discovery.get_discovered_summary()
-            return jsonify(summary)
+            summary = self.discovery.iter_discovered_summary()
+            return Response(stream_with_context(_json_array_stream(summary)),
+                            mimetype='application/json')
         
         @self.app.route('/api/config', methods=['GET'])
         def get_config():
-            config = self.device_manager.config_manager.config.copy()
-            # Sanitize sensitive data
-            if 'devices' in config:
-                for device in config['devices'].values():
-                    if 'local_key' in device:
-                        device['local_key'] = '***'
-            if 'mqtt' in config and 'password' in config['mqtt']:
-                config['mqtt']['password'] = '***'
-            return jsonify(config)
+            return Response(self._safe_config(), mimetype='application/json')
+    
+    def _cached_json(self, key, ttl, build):
+        """Return the JSON response for `key`, calling build() at most once per `ttl` seconds"""
+        return Response(self._cached_bytes(key, ttl, build), mimetype='application/json')
+    
+    def _cached_bytes(self, key, ttl, build):
+        """Get the encoded JSON for `key`, calling build() at most once per `ttl` seconds"""
+        now = time.monotonic()
+        cache = self._response_cache
+        entry = cache.get(key)
+        if entry is None or entry[0] <= now:
+            # Built outside the lock, so a slow build doesn't hold up other keys
+            entry = (now + ttl, _dumps(build()))
+            # Request threads share the cache, prune and insert one at a time
+            with self._response_cache_lock:
+                # Re-inserted, so the dict order stays the order entries were built in
+                cache.pop(key, None)
+                if len(cache) >= RESPONSE_CACHE_SIZE:
+                    for stale in [k for k, (expires, _) in cache.items() if expires <= now]:
+                        del cache[stale]
+                    while len(cache) >= RESPONSE_CACHE_SIZE:
+                        del cache[next(iter(cache))]
+                cache[key] = entry
+        return entry[1]
+    
+    def _run_scan(self, force: bool):
+        """Scan the network and summarize the result for the web interface"""
+        try:
+            devices = self.discovery.scan_network_sync(bypass_cache=force)
+            summary = self.discovery.get_discovered_summary()
+            return {
+                'success': True,
+                'discovered': len(devices),
+                'devices': summary,
+                'message': f'Found {len(devices)} devices. Check logs for details.'
+            }
+        except Exception as e:
+            logger.error(f"Scan failed: {e}", exc_info=True)
+            return {
+                'success': False,
+                'error': str(e),
+                'message': 'Scan failed. Check logs for details.'
+            }
+    
+    def _get_index_page(self):
+        """Render the index page once, keeping it with its ETag and gzipped"""
+        if self._index_page is None:
+            body = render_template('index.html').encode()
+            etag = hashlib.blake2b(body, digest_size=8).hexdigest()
+            self._index_page = (etag, body, gzip.compress(body, INDEX_COMPRESS_LEVEL))
+        return self._index_page
+    
+    def _asset_url(self, filename):
+        """Get the URL of a static asset, versioned by its content"""
+        version = self._asset_versions.get(filename)
+        if version is None:
+            data = (Path(self.app.static_folder) / filename).read_bytes()
+            version = hashlib.blake2b(data, digest_size=8).hexdigest()
+            self._asset_versions[filename] = version
+        return url_for('static', filename=filename, v=version)
+    
+    def _cache_static(self, response):
+        """Mark versioned static assets as cacheable for good"""
+        if response.status_code == 200 and 'v' in request.args and request.path.startswith('/static/'):
+            response.headers['Cache-Control'] = STATIC_CACHE_CONTROL
+        return response
+    
+    def _compress_response(self, response):
+        """Gzip a buffered response body when the client accepts gzip"""
+        if (response.direct_passthrough or response.is_streamed
+                or response.mimetype not in COMPRESS_MIMETYPES
+                or 'Content-Encoding' in response.headers
+                or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+            return response
+        
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        
+        response.set_data(gzip.compress(data, COMPRESS_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        return response
+    
+    def _on_device_status(self, device):
+        """Wake the event streams after a device status update"""
+        with self._state_changed:
+            self._state_seq += 1
+            self._state_changed.notify_all()
+    
+    def _on_scan_done(self, task_id):
+        """Wake the event streams to announce a finished scan"""
+        with self._state_changed:
+            self._scan_done_id = task_id
+            self._state_seq += 1
+            self._state_changed.notify_all()
+    
+    def _device_events(self):
+        """Yield an event for every device on connect, then for each changed device and finished scan"""
+        devices = self.device_manager.devices
+        sent_versions = {}
+        seq = None
+        scan_id = self._scan_done_id
+        while True:
+            with self._state_changed:
+                if not self._state_changed.wait_for(lambda: self._state_seq != seq, STREAM_KEEPALIVE):
+                    yield b': keepalive\n\n'
+                    continue
+                seq = self._state_seq
+                done_id = self._scan_done_id
+            
+            if done_id != scan_id:
+                scan_id = done_id
+                yield b'event: scan_complete\ndata: ' + _dumps({'task_id': done_id}) + b'\n\n'
+            
+            for device in devices.values():
+                version = device.state_version
+                if sent_versions.get(device.device_id) != version:
+                    sent_versions[device.device_id] = version
+                    yield b'data: ' + self._device_json(device) + b'\n\n'
+    
+    def _device_json(self, device) -> bytes:
+        """Get the encoded to_dict() of a device, re-encoded only after its state changed"""
+        # Read the version first, so a concurrent update is never cached as current
+        version = device.state_version
+        entry = self._device_json_cache.get(device.device_id)
+        if entry is None or entry[0] != version:
+            entry = (version, _dumps(device.to_dict()))
+            self._device_json_cache[device.device_id] = entry
+        return entry[1]
+    
+    def _devices_json(self):
+        """Get the ETag and encoded list of all devices, rebuilt only after a state changed"""
+        devices = self.device_manager.devices.values()
+        versions = tuple(d.state_version for d in devices)
+        entry = self._devices_json_cache
+        if entry is None or entry[0] != versions:
+            body = b'[' + b','.join(self._device_json(d) for d in devices) + b']'
+            entry = (versions, hashlib.blake2b(body, digest_size=8).hexdigest(), body)
+            self._devices_json_cache = entry
+        return entry[1], entry[2]
+    
+    def _build_stats(self):
+        """Collect bridge statistics"""
+        devices_total = devices_online = 0
+        for device in self.device_manager.devices.values():
+            devices_total += 1
+            devices_online += device.available
+        
+        stats = {
+            'uptime': self._format_uptime(),
+            'devices_total': devices_total,
+            'devices_online': devices_online,
+            'entities_total': self.device_manager.entity_count,
+            'mqtt_sent': self.mqtt_handler.stats['messages_sent'],
+            'mqtt_received': self.mqtt_handler.stats['messages_received']
+        }
+        
+        if self.database:
+            db_stats = self.database.get_statistics()
+            stats.update(db_stats)
+        
+        return stats
+    
+    def _format_uptime(self) -> str:
+        """Format the uptime like str(timedelta), without the fraction"""
+        minutes, seconds = divmod(int(time.monotonic() - self._start_mono), 60)
+        hours, minutes = divmod(minutes, 60)
+        days, hours = divmod(hours, 24)
+        uptime = f"{hours}:{minutes:02d}:{seconds:02d}"
+        if days:
+            uptime = f"{days} day{'s' if days != 1 else ''}, {uptime}"
+        return uptime
+    
+    def _safe_config(self) -> bytes:
+        """Get the encoded configuration with secrets masked, rebuilt when the config is replaced"""
+        config = self.device_manager.config_manager.config
+        if config is not self._safe_config_source:
+            self._safe_config_json = _dumps(self._redact_config(config))
+            self._safe_config_source = config
+        return self._safe_config_json
+    
+    @staticmethod
+    def _redact_config(config):
+        """Return a copy of the configuration with secrets masked"""
+        # Deep copy, the masking must not touch the live device and MQTT sections
+        config = copy.deepcopy(config)
+        # Sanitize sensitive data
+        if 'devices' in config:
+            for device in config['devices'].values():
+                if 'local_key' in device:
+                    device['local_key'] = '***'
+        if 'mqtt' in config and 'password' in config['mqtt']:
+            config['mqtt']['password'] = '***'
+        return config
     
     def _handle_entity_control(self, device, entity, data):
         """Handle entity control from web interface"""
         try:
             dps_changes = {}
+            dps_map = entity.dps_map
             
-            # Universal switch/power control
-            if 'state' in data:
-                switch_dps = entity.get_dps('switch') or entity.get_dps('power') or entity.get_dps('lock')
-                if switch_dps:
-                    dps_changes[switch_dps] = data['state']
-            
-            # Brightness/Speed/Level control
-            if 'brightness' in data or 'level' in data:
-                value = data.get('brightness', data.get('level', 0))
-                brightness_dps = entity.get_dps('brightness') or entity.get_dps('speed')
-                if brightness_dps:
-                    if entity.platform == 'light':
-                        min_val, max_val = entity.brightness_range
-                        scaled = int(min_val + (value / 100) * (max_val - min_val))
-                    else:
-                        min_val, max_val = entity.speed_range
-                        scaled = int(min_val + (value / 100) * (max_val - min_val))
-                    dps_changes[brightness_dps] = scaled
-            
-            # Temperature control
-            if 'temperature' in data or 'target_temp' in data:
-                temp = data.get('temperature', data.get('target_temp'))
-                temp_dps = entity.get_dps('target_temp')
-                if temp_dps:
-                    dps_changes[temp_dps] = int(temp / entity.temp_step)
-            
-            # Mode control
-            if 'mode' in data:
-                mode_dps = entity.get_dps('mode')
-                if mode_dps:
-                    dps_changes[mode_dps] = data['mode']
-            
-            # Position control (cover)
-            if 'position' in data:
-                pos_dps = entity.get_dps('position')
-                if pos_dps:
-                    dps_changes[pos_dps] = int(data['position'])
-            
-            # Humidity control
-            if 'target_humidity' in data:
-                humidity_dps = entity.get_dps('target_humidity')
-                if humidity_dps:
-                    dps_changes[humidity_dps] = int(data['target_humidity'])
+            for key, value in data.items():
+                control = _CONTROLS.get(key)
+                if control is None:
+                    continue
+                codes, transform, preferred = control
+                if preferred and preferred in data:
+                    continue
+                dps = next((dps_map[code] for code in codes if dps_map.get(code)), None)
+                if dps:
+                    dps_changes[dps] = transform(entity, value)
             
             # Apply changes
             if dps_changes:
-                if len(dps_changes) == 1:
-                    dps, value = list(dps_changes.items())[0]
-                    return device.set_dps(dps, value)
-                else:
-                    return device.set_multiple_dps(dps_changes)
+                self._queue_dps(device, dps_changes)
+                return True
             
             return False
         except Exception as e:
             logger.error(f"Error handling entity control: {e}")
             return False
     
-    def _create_templates(self):
-        """Create enhanced HTML template"""
-        templates_dir = Path('templates')
-        templates_dir.mkdir(exist_ok=True)
-        
-        html = '''<!DOCTYPE html>
-<html lang="cs">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Tuya2MQTT Bridge v2.0</title>
-    <style>
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        
-        :root {
-            --primary: #667eea;
-            --secondary: #764ba2;
-            --success: #4caf50;
-            --danger: #f44336;
-            --warning: #ff9800;
-            --info: #2196f3;
-            --dark: #333;
-            --light: #f8f9fa;
-        }
-        
-        body {
-            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
-            background: linear-gradient(135deg, var(--primary) 0%, var(--secondary) 100%);
-            min-height: 100vh;
-            padding: 20px;
-        }
-        
-        .container { max-width: 1600px; margin: 0 auto; }
-        
-        .header {
-            background: white;
-            padding: 30px;
-            border-radius: 15px;
-            box-shadow: 0 10px 40px rgba(0,0,0,0.2);
-            margin-bottom: 30px;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
-        
-        .header-left h1 { color: var(--primary); font-size: 2.5em; margin-bottom: 5px; }
-        .header-left .subtitle { color: #666; font-size: 1.1em; }
-        .header-left .version { color: #999; font-size: 0.9em; margin-top: 5px; }
-        
-        .header-right { display: flex; gap: 10px; }
-        .btn {
-            padding: 10px 20px;
-            border: none;
-            border-radius: 8px;
-            cursor: pointer;
-            font-size: 1em;
-            font-weight: 600;
-            transition: all 0.3s;
-        }
-        .btn-primary { background: var(--primary); color: white; }
-        .btn-primary:hover { background: #5568d3; transform: translateY(-2px); }
-        .btn-success { background: var(--success); color: white; }
-        .btn-success:hover { background: #45a049; }
-        
-        .stats-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(160px, 1fr));
-            gap: 15px;
-            margin-bottom: 30px;
-        }
-        
-        .stat-card {
-            background: white;
-            padding: 20px;
-            border-radius: 12px;
-            box-shadow: 0 5px 20px rgba(0,0,0,0.1);
-            transition: transform 0.3s;
-        }
-        .stat-card:hover { transform: translateY(-5px); }
-        .stat-value { font-size: 2em; font-weight: bold; color: var(--primary); }
-        .stat-label { color: #666; margin-top: 5px; font-size: 0.9em; }
-        
-        .tabs {
-            display: flex;
-            gap: 10px;
-            margin-bottom: 20px;
-        }
-        .tab {
-            padding: 12px 24px;
-            background: white;
-            border: none;
-            border-radius: 10px;
-            cursor: pointer;
-            font-weight: 600;
-            transition: all 0.3s;
-        }
-        .tab.active {
-            background: var(--primary);
-            color: white;
-        }
-        
-        .tab-content { display: none; }
-        .tab-content.active { display: block; }
-        
-        .devices-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fill, minmax(380px, 1fr));
-            gap: 20px;
-        }
-        
-        .device-card {
-            background: white;
-            padding: 25px;
-            border-radius: 15px;
-            box-shadow: 0 5px 25px rgba(0,0,0,0.15);
-            transition: all 0.3s;
-        }
-        .device-card:hover { transform: translateY(-5px); box-shadow: 0 10px 35px rgba(0,0,0,0.2); }
-        
-        .device-header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 20px;
-            padding-bottom: 15px;
-            border-bottom: 2px solid #f0f0f0;
-        }
-        
-        .device-name { font-size: 1.5em; font-weight: bold; color: var(--dark); }
-        .device-status {
-            padding: 6px 16px;
-            border-radius: 20px;
-            font-size: 0.85em;
-            font-weight: bold;
-        }
-        .status-online { background: var(--success); color: white; }
-        .status-offline { background: var(--danger); color: white; }
-        
-        .entities { display: flex; flex-direction: column; gap: 15px; }
-        
-        .entity {
-            background: var(--light);
-            padding: 18px;
-            border-radius: 12px;
-            border-left: 4px solid var(--primary);
-        }
-        
-        .entity-header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 12px;
-        }
-        
-        .entity-name { font-weight: 600; color: var(--dark); font-size: 1.1em; }
-        .entity-platform {
-            background: var(--primary);
-            color: white;
-            padding: 4px 12px;
-            border-radius: 12px;
-            font-size: 0.75em;
-            text-transform: uppercase;
-        }
-        
-        .entity-controls { display: flex; flex-direction: column; gap: 12px; }
-        
-        .control-row {
-            display: flex;
-            align-items: center;
-            gap: 12px;
-        }
-        
-        .control-label {
-            min-width: 100px;
-            font-size: 0.95em;
-            color: #666;
-            font-weight: 500;
-        }
-        
-        .control-value {
-            min-width: 60px;
-            text-align: right;
-            font-weight: 700;
-            color: var(--primary);
-            font-size: 1.05em;
-        }
-        
-        .toggle {
-            position: relative;
-            width: 60px;
-            height: 30px;
-            background: #ccc;
-            border-radius: 15px;
-            cursor: pointer;
-            transition: background 0.3s;
-        }
-        .toggle.active { background: var(--success); }
-        .toggle::after {
-            content: '';
-            position: absolute;
-            width: 26px;
-            height: 26px;
-            border-radius: 50%;
-            background: white;
-            top: 2px;
-            left: 2px;
-            transition: transform 0.3s;
-            box-shadow: 0 2px 5px rgba(0,0,0,0.2);
-        }
-        .toggle.active::after { transform: translateX(30px); }
-        
-        .slider-container {
-            flex: 1;
-            position: relative;
-            height: 8px;
-            background: #ddd;
-            border-radius: 4px;
-            cursor: pointer;
-        }
-        .slider-fill {
-            height: 100%;
-            background: linear-gradient(90deg, var(--primary), var(--secondary));
-            border-radius: 4px;
-            transition: width 0.2s;
-        }
-        .slider-thumb {
-            position: absolute;
-            width: 20px;
-            height: 20px;
-            border-radius: 50%;
-            background: white;
-            border: 3px solid var(--primary);
-            top: -6px;
-            cursor: grab;
-            box-shadow: 0 2px 8px rgba(0,0,0,0.2);
-            transition: box-shadow 0.2s;
-        }
-        .slider-thumb:active { cursor: grabbing; box-shadow: 0 4px 12px rgba(0,0,0,0.3); }
-        
-        .dps-info {
-            margin-top: 12px;
-            padding-top: 12px;
-            border-top: 1px solid #ddd;
-            font-size: 0.85em;
-            color: #666;
-            font-family: 'Courier New', monospace;
-        }
-        
-        .loading {
-            text-align: center;
-            color: white;
-            font-size: 1.8em;
-            padding: 60px;
-            animation: pulse 1.5s ease-in-out infinite;
-        }
-        
-        @keyframes pulse {
-            0%, 100% { opacity: 1; }
-            50% { opacity: 0.5; }
-        }
-        
-        .platform-light { border-left-color: #ffd700; }
-        .platform-switch { border-left-color: #2196f3; }
-        .platform-fan { border-left-color: #00bcd4; }
-        .platform-climate { border-left-color: #ff5722; }
-        .platform-sensor { border-left-color: #4caf50; }
-        .platform-alarm_control_panel { border-left-color: #f44336; }
-        .platform-vacuum { border-left-color: #9c27b0; }
-        .platform-lock { border-left-color: #795548; }
-        
-        @media (max-width: 768px) {
-            .devices-grid { grid-template-columns: 1fr; }
-            .header { flex-direction: column; gap: 20px; }
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <div class="header-left">
-                <h1>🔌 Tuya2MQTT Bridge</h1>
-                <div class="subtitle">Enhanced s databází a auto-detekcí</div>
-                <div class="version">v2.0 | Home Assistant Compatible</div>
-            </div>
-            <div class="header-right">
-                <button class="btn btn-success" onclick="scanDevices()">🔍 Skenovat zařízení</button>
-                <button class="btn btn-primary" onclick="refreshAll()">🔄 Obnovit</button>
-            </div>
-        </div>
-        
-        <div class="stats-grid" id="stats"></div>
-        
-        <div class="tabs">
-            <button class="tab active" onclick="showTab('devices')">📱 Zařízení</button>
-            <button class="tab" onclick="showTab('unconfigured')">🔍 Nenakonfigurovaná</button>
-            <button class="tab" onclick="showTab('entities')">⚙️ Entity</button>
-        </div>
-        
-        <div id="devices-tab" class="tab-content active">
-            <div class="devices-grid" id="devices">
-                <div class="loading">⏳ Načítám zařízení...</div>
-            </div>
-        </div>
-        
-        <div id="unconfigured-tab" class="tab-content">
-            <div id="unconfigured-devices">
-                <div class="loading">⏳ Načítám nenakonfigurovaná zařízení...</div>
-            </div>
-        </div>
-        
-        <div id="entities-tab" class="tab-content">
-            <div class="devices-grid" id="entities-list"></div>
-        </div>
-    </div>
+    def _queue_dps(self, device, dps_changes):
+        """Add DPS changes to the batch sent to the device after CONTROL_COALESCE_DELAY"""
+        with self._pending_lock:
+            pending = self._pending_dps.get(device.device_id)
+            if pending is not None:
+                pending.update(dps_changes)
+                return
+            self._pending_dps[device.device_id] = dict(dps_changes)
+        self.device_manager.call_later(CONTROL_COALESCE_DELAY, self._flush_dps, device)
     
-    <script>
-        let devicesData = {};
-        
-        function showTab(tab) {
-            document.querySelectorAll('.tab').forEach(t => t.classList.remove('active'));
-            document.querySelectorAll('.tab-content').forEach(c => c.classList.remove('active'));
-            event.target.classList.add('active');
-            document.getElementById(tab + '-tab').classList.add('active');
-            
-            if (tab === 'unconfigured') loadUnconfiguredDevices();
-            if (tab === 'entities') loadEntitiesList();
-        }
-        
-        async function loadUnconfiguredDevices() {
-            try {
-                const res = await fetch('/api/devices/unconfigured');
-                const devices = await res.json();
-                
-                const container = document.getElementById('unconfigured-devices');
-                
-                if (devices.length === 0) {
-                    container.innerHTML = `
-                        <div class="device-card" style="text-align: center; padding: 40px;">
-                            <h2 style="color: #4caf50; margin-bottom: 10px;">✅ Vše nakonfigurováno!</h2>
-                            <p style="color: #666;">Žádná nenakonfigurovaná zařízení nebyla nalezena.</p>
-                            <p style="color: #666; margin-top: 10px;">Klikněte na "🔍 Skenovat zařízení" pro vyhledání nových.</p>
-                        </div>
-                    `;
-                    return;
-                }
-                
-                container.innerHTML = devices.map(device => `
-                    <div class="device-card" style="border: 2px solid #ff9800;">
-                        <div class="device-header">
-                            <div class="device-name">Nenakonfigurované zařízení</div>
-                            <div class="device-status" style="background: #ff9800;">Nové</div>
-                        </div>
-                        <div style="margin-bottom: 15px; padding: 15px; background: #fff3e0; border-radius: 8px;">
-                            <div style="margin-bottom: 8px;"><strong>ID:</strong> ${device.id}</div>
-                            <div style="margin-bottom: 8px;"><strong>IP:</strong> ${device.ip}</div>
-                            <div style="margin-bottom: 8px;"><strong>Verze:</strong> ${device.version}</div>
-                            ${device.product_id ? `<div><strong>Product ID:</strong> ${device.product_id}</div>` : ''}
-                        </div>
-                        <div style="padding: 15px; background: #f8f9fa; border-radius: 8px; font-size: 0.9em;">
-                            <strong>📝 Jak přidat:</strong>
-                            <ol style="margin: 10px 0 0 20px; line-height: 1.8;">
-                                <li>Získejte local_key: <code style="background: white; padding: 2px 6px; border-radius: 3px;">python -m tinytuya wizard</code></li>
-                                <li>Přidejte do <code style="background: white; padding: 2px 6px; border-radius: 3px;">config.yaml</code></li>
-                                <li>Restartujte bridge</li>
-                            </ol>
-                        </div>
-                        <button class="btn btn-primary" style="width: 100%; margin-top: 10px;" 
-                                onclick="copyDeviceTemplate('${device.id}', '${device.ip}', '${device.version}')">
-                            📋 Kopírovat šablonu konfigurace
-                        </button>
-                    </div>
-                `).join('');
-            } catch (e) {
-                console.error('Chyba:', e);
-                document.getElementById('unconfigured-devices').innerHTML = 
-                    '<div class="loading">❌ Chyba při načítání</div>';
-            }
-        }
-        
-        function copyDeviceTemplate(deviceId, ip, version) {
-            const template = `  ${deviceId}:
-    name: "Nové zařízení"
-    ip: "${ip}"
-    local_key: "ZÍSKEJTE_POMOCÍ_TINYTUYA_WIZARD"
-    version: "${version}"
-    entities:
-      - platform: switch
-        name: "main_switch"
-        friendly_name: "Hlavní vypínač"
-        dps:
-          switch: 1
-        icon: "mdi:power"`;
-            
-            navigator.clipboard.writeText(template).then(() => {
-                alert('✅ Šablona zkopírována do schránky!\n\nVložte ji do config.yaml pod sekci "devices:"');
-            }).catch(() => {
-                alert('❌ Nepodařilo se zkopírovat. Zkopírujte ručně:\n\n' + template);
-            });
-        }
-        
-        async function loadStats() {
-            try {
-                const res = await fetch('/api/stats');
-                const stats = await res.json();
-                
-                let html = `
-                    <div class="stat-card">
-                        <div class="stat-value">${stats.uptime}</div>
-                        <div class="stat-label">⏱️ Uptime</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-value">${stats.devices_online}/${stats.devices_total}</div>
-                        <div class="stat-label">📱 Online zařízení</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-value">${stats.entities_total}</div>
-                        <div class="stat-label">⚙️ Entity</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-value">${stats.mqtt_sent + stats.mqtt_received}</div>
-                        <div class="stat-label">📨 MQTT zprávy</div>
-                    </div>
-                `;
-                
-                if (stats.history_records !== undefined) {
-                    html += `
-                        <div class="stat-card">
-                            <div class="stat-value">${stats.history_records}</div>
-                            <div class="stat-label">💾 DB záznamy</div>
-                        </div>
-                    `;
-                }
-                
-                document.getElementById('stats').innerHTML = html;
-            } catch (e) {
-                console.error('Chyba:', e);
-            }
-        }
-        
-        async function loadDevices() {
-            try {
-                const res = await fetch('/api/devices');
-                const devices = await res.json();
-                devicesData = {};
-                devices.forEach(d => devicesData[d.device_id] = d);
-                
-                const container = document.getElementById('devices');
-                container.innerHTML = devices.map(createDeviceCard).join('');
-                attachEventListeners();
-            } catch (e) {
-                console.error('Chyba:', e);
-                document.getElementById('devices').innerHTML = '<div class="loading">❌ Chyba při načítání</div>';
-            }
-        }
-        
-        function createDeviceCard(device) {
-            const statusClass = device.available ? 'status-online' : 'status-offline';
-            const statusText = device.available ? 'Online' : 'Offline';
-            const entitiesHtml = device.entities.map(e => createEntityControl(device, e)).join('');
-            
-            return `
-                <div class="device-card">
-                    <div class="device-header">
-                        <div class="device-name">${device.name}</div>
-                        <div class="device-status ${statusClass}">${statusText}</div>
-                    </div>
-                    <div class="entities">${entitiesHtml}</div>
-                </div>
-            `;
-        }
-        
-        function createEntityControl(device, entity) {
-            const platform = entity.platform;
-            let controls = '';
-            
-            if (['light', 'switch', 'fan', 'lock'].includes(platform)) {
-                const isOn = entity.state.switch || entity.state.lock || false;
-                controls += `
-                    <div class="control-row">
-                        <span class="control-label">Stav:</span>
-                        <div class="toggle ${isOn ? 'active' : ''}" 
-                             data-entity="${entity.entity_id}" 
-                             data-control="switch"></div>
-                    </div>
-                `;
-                
-                if (platform === 'light' && entity.state.brightness !== undefined) {
-                    const brightness = Math.round((entity.state.brightness / 1000) * 100);
-                    controls += createSlider(entity.entity_id, 'brightness', brightness, 'Jas');
-                } else if (platform === 'fan' && entity.state.speed !== undefined) {
-                    controls += createSlider(entity.entity_id, 'brightness', entity.state.speed * 33, 'Rychlost');
-                }
-            } else if (platform === 'climate') {
-                const temp = entity.state.target_temp || 20;
-                controls += `
-                    <div class="control-row">
-                        <span class="control-label">Teplota:</span>
-                        <div class="control-value">${temp}°C</div>
-                    </div>
-                `;
-            } else if (platform === 'sensor') {
-                const value = entity.state.value || 0;
-                const unit = entity.unit_of_measurement || '';
-                controls += `
-                    <div class="control-row">
-                        <span class="control-label">Hodnota:</span>
-                        <div class="control-value">${value} ${unit}</div>
-                    </div>
-                `;
-            }
-            
-            const dps = Object.entries(entity.state).map(([k,v]) => `${k}: ${JSON.stringify(v)}`).join(', ');
-            
-            // Show unmapped DPS if available
-            let unmappedHtml = '';
-            if (device.unmapped_dps && Object.keys(device.unmapped_dps).length > 0) {
-                const unmappedEntries = Object.entries(device.unmapped_dps)
-                    .map(([dps, val]) => `DPS ${dps}: ${JSON.stringify(val)}`)
-                    .join(', ');
-                unmappedHtml = `
-                    <div style="margin-top: 10px; padding: 10px; background: #fff3cd; border-left: 4px solid #ffc107; border-radius: 4px; font-size: 0.85em;">
-                        <strong>⚠️ Nepřiřazené DPS:</strong> ${unmappedEntries}
-                    </div>
-                `;
-            }
-            
-            return `
-                <div class="entity platform-${platform}">
-                    <div class="entity-header">
-                        <div class="entity-name">${entity.friendly_name}</div>
-                        <div class="entity-platform">${platform}</div>
-                    </div>
-                    <div class="entity-controls">${controls}</div>
-                    <div class="dps-info">DPS: ${dps}</div>
-                    ${unmappedHtml}
-                </div>
-            `;
-        }
-        
-        function createSlider(entityId, control, value, label) {
-            return `
-                <div class="control-row">
-                    <span class="control-label">${label}:</span>
-                    <div class="slider-container" data-entity="${entityId}" data-control="${control}">
-                        <div class="slider-fill" style="width: ${value}%"></div>
-                        <div class="slider-thumb" style="left: calc(${value}% - 10px)"></div>
-                    </div>
-                    <div class="control-value">${Math.round(value)}%</div>
-                </div>
-            `;
-        }
-        
-        function attachEventListeners() {
-            document.querySelectorAll('.toggle').forEach(toggle => {
-                toggle.onclick = async function() {
-                    const entityId = this.dataset.entity;
-                    const isActive = this.classList.contains('active');
-                    await controlEntity(entityId, { state: !isActive });
-                };
-            });
-            
-            document.querySelectorAll('.slider-container').forEach(slider => {
-                const thumb = slider.querySelector('.slider-thumb');
-                let isDragging = false;
-                
-                function updateSlider(e) {
-                    const rect = slider.getBoundingClientRect();
-                    const x = Math.max(0, Math.min(e.clientX - rect.left, rect.width));
-                    const percent = Math.round((x / rect.width) * 100);
-                    
-                    slider.querySelector('.slider-fill').style.width = percent + '%';
-                    thumb.style.left = `calc(${percent}% - 10px)`;
-                    slider.nextElementSibling.textContent = percent + '%';
-                    return percent;
-                }
-                
-                thumb.onmousedown = () => isDragging = true;
-                document.onmousemove = (e) => { if (isDragging) updateSlider(e); };
-                document.onmouseup = async (e) => {
-                    if (isDragging) {
-                        const percent = updateSlider(e);
-                        const entityId = slider.dataset.entity;
-                        const control = slider.dataset.control;
-                        await controlEntity(entityId, { [control]: percent });
-                        isDragging = false;
-                    }
-                };
-                
-                slider.onclick = async (e) => {
-                    if (e.target !== thumb) {
-                        const percent = updateSlider(e);
-                        await controlEntity(entityId, { [slider.dataset.control]: percent });
-                    }
-                };
-            });
-        }
-        
-        async function controlEntity(entityId, data) {
-            const parts = entityId.split('_');
-            const deviceId = parts[0];
-            const entityName = parts.slice(1).join('_');
-            
-            try {
-                const res = await fetch(`/api/device/${deviceId}/entity/${entityName}/set`, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify(data)
-                });
-                
-                if (res.ok) setTimeout(loadDevices, 500);
-            } catch (e) {
-                console.error('Chyba:', e);
-            }
-        }
-        
-        async function loadEntitiesList() {
-            const entities = document.getElementById('entities-list');
-            entities.innerHTML = '<div class="loading">Načítám všechny entity...</div>';
-            
-            try {
-                const res = await fetch('/api/devices');
-                const devices = await res.json();
-                
-                let allEntities = [];
-                devices.forEach(device => {
-                    device.entities.forEach(entity => {
-                        allEntities.push({
-                            device: device,
-                            entity: entity
-                        });
-                    });
-                });
-                
-                if (allEntities.length === 0) {
-                    entities.innerHTML = '<div class="loading">Žádné entity nenalezeny</div>';
-                    return;
-                }
-                
-                entities.innerHTML = allEntities.map(item => `
-                    <div class="device-card">
-                        <div class="entity-header" style="margin-bottom: 15px;">
-                            <div>
-                                <div class="entity-name">${item.entity.friendly_name}</div>
-                                <div style="color: #666; font-size: 0.9em; margin-top: 5px;">
-                                    ${item.device.name} (${item.entity.entity_id})
-                                </div>
-                            </div>
-                            <div class="entity-platform">${item.entity.platform}</div>
-                        </div>
-                        <div style="background: #f8f9fa; padding: 15px; border-radius: 8px;">
-                            <div style="margin-bottom: 10px;"><strong>Stav:</strong> ${JSON.stringify(item.entity.state)}</div>
-                            <div style="margin-bottom: 10px;"><strong>DPS mapování:</strong> ${JSON.stringify(item.entity.dps_map)}</div>
-                            ${item.entity.icon ? `<div><strong>Ikona:</strong> ${item.entity.icon}</div>` : ''}
-                        </div>
-                    </div>
-                `).join('');
-            } catch (e) {
-                console.error('Chyba:', e);
-                entities.innerHTML = '<div class="loading">❌ Chyba při načítání</div>';
-            }
-        }
-        
-        async function loadDatabaseStats() {
-            // Removed - no longer needed
-        }
-        
-        async function scanDevices() {
-            if (!confirm('Spustit sken sítě pro Tuya zařízení? Trvá 20-30 sekund.')) return;
-            
-            const btn = event.target;
-            const originalText = btn.innerHTML;
-            btn.innerHTML = '⏳ Skenování...';
-            btn.disabled = true;
-            
-            try {
-                const res = await fetch('/api/discovery/scan', { method: 'POST' });
-                const data = await res.json();
-                
-                if (data.success) {
-                    const unconfigured = data.devices.filter(d => !d.configured);
-                    let message = `✅ Nalezeno ${data.discovered} zařízení!\n\n`;
-                    
-                    if (unconfigured.length > 0) {
-                        message += `⚠️ Nenakonfigurovaná zařízení: ${unconfigured.length}\n`;
-                        message += 'Zobrazují se v sekci "Nenakonfigurovaná zařízení"\n\n';
-                        unconfigured.forEach(d => {
-                            message += `• ${d.id.substring(0, 16)}...\n`;
-                            message += `  IP: ${d.ip}\n`;
-                        });
-                    } else {
-                        message += 'Všechna nalezená zařízení jsou již nakonfigurovaná.';
-                    }
-                    
-                    alert(message);
-                    loadDevices();
-                    loadUnconfiguredDevices();
-                } else {
-                    alert('❌ Chyba při skenování: ' + (data.error || data.message));
-                }
-            } catch (e) {
-                alert('❌ Chyba při skenování: ' + e.message);
-            } finally {
-                btn.innerHTML = originalText;
-                btn.disabled = false;
-            }
-        }
-        
-        function refreshAll() {
-            loadStats();
-            loadDevices();
-        }
-        
-        // Inicializace
-        loadStats();
-        loadDevices();
-        loadUnconfiguredDevices();
-        setInterval(() => { loadStats(); loadDevices(); }, 5000);
-    </script>
-</body>
-</html>'''
-        
-        with open(templates_dir / 'index.html', 'w', encoding='utf-8') as f:
-            f.write(html)
-        logger.info("Created enhanced web interface")
+    def _flush_dps(self, device):
+        """Send the DPS changes collected for a device in one command"""
+        with self._pending_lock:
+            dps_changes = self._pending_dps.pop(device.device_id, None)
+        if dps_changes and device.set_multiple_dps(dps_changes):
+            # Keeps MQTT from dropping a command that undoes this change
+            self.mqtt_handler.remember_sent_dps(device, dps_changes)
+            self.mqtt_handler.schedule_refresh(device)
     
     def start(self):
         """Start web server"""
+        # Render and compress the page up front instead of on the first visit
+        try:
+            with self.app.test_request_context('/'):
+                self._get_index_page()
+        except Exception as e:
+            logger.error(f"Failed to render web interface: {e}")
+        
         def run():
-            self.app.run(host='0.0.0.0', port=self.port, debug=False, use_reloader=False)
+            if waitress:
+                waitress.serve(self.app, host='0.0.0.0', port=self.port, threads=WEB_THREADS,
+                               connection_limit=WEB_CONNECTION_LIMIT, channel_timeout=WEB_CHANNEL_TIMEOUT)
+                return
+            # Requests get a thread each, so one waiting on a slow device
+            # does not hold up the UI's other requests
+            self.app.run(host='0.0.0.0', port=self.port, debug=False, use_reloader=False, threaded=True)
         
         self.server_thread = threading.Thread(target=run, daemon=True)
         self.server_thread.start()
@@ -941,4 +581,5 @@ class WebServer:
     
     def stop(self):
         """Stop web server"""
+        self._scan_executor.shutdown(wait=False)
         logger.info("Web server stopped")
\ No newline at end of file